@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+# main.py / info.py を CGI の fork なしで 1 つの常駐プロセスから配信する WSGI アプリ
+# python app.py [--host 0.0.0.0] [--port 8000] [--workers 4]
+# 他の WSGI サーバから使う場合は app:application を指定する
+
+import os, sys, json, time, queue, signal, mimetypes, threading, argparse, traceback, importlib
+from urllib.parse import parse_qs
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+rootDir                     = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(rootDir, "cgi-bin"))
+sys.path.insert(0, os.path.join(rootDir, "lib"))
+
+import main, info, common
+
+staticDirs                  = ("/template/", "/view/", "/img/")
+staticFiles                 = ("/favicon.ico", "/index.html")
+distPrefix                  = "/view/dist/"         # build_static.py が作るハッシュ付きのファイル
+infoData                    = None                  # JSONDataCreate はプロセスに 1 つ (リクエストごとには for_request() の複製を使う)
+infoLock                    = threading.Lock()
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads          = True
+    request_queue_size      = 128       # SSE で多数の接続を同時に受けるので listen の backlog を広げる
+
+class QuietHandler(WSGIRequestHandler):
+    timeout                 = 60        # 読まなくなった SSE クライアントへの送信で固まったスレッドを解放する
+    def log_message(self, format, *args):
+        if os.environ.get("CGITEST_ACCESS_LOG"):
+            super().log_message(format, *args)
+
+def request_params(environ):    # GET のクエリと POST のフォームをまとめて返す
+    params                  = parse_qs(environ.get("QUERY_STRING", ""))
+    if environ.get("REQUEST_METHOD") == "POST":
+        try:
+            length          = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length          = 0
+        body                = environ["wsgi.input"].read(length).decode("UTF-8", "replace")
+        params.update(parse_qs(body))
+    return {key : values[0] for key, values in params.items()}
+
+class Subscriber:   # SSE の購読者 1 人分。送り切れない分はキューが溢れた時点で捨てる
+    def __init__(self, size):
+        self.queue          = queue.Queue(size)
+        self.drops          = 0
+        self.closed         = False
+
+class LiveHub:      # 1 周期に 1 回だけ live_snapshot を取り、全購読者に同じ差分を配る (購読者数で上流への問い合わせが増えない)
+    resync                  = object()          # キューに入れると次は全体を送る
+
+    def __init__(self, queueSize = 8, maxDrops = 3):
+        self.queueSize      = queueSize
+        self.maxDrops       = maxDrops          # これ以上追いつけない購読者は切断する (ブラウザは再接続して全体から受け直す)
+        self.subscribers    = set()
+        self.lock           = threading.Lock()
+        self.wake           = threading.Event()
+        self.thread         = None
+        self.snapshot       = None
+        self.full           = None              # 最新版の全体 (新規購読者と追いつけなかった購読者に送る)
+        self.cycles         = 0
+
+    def event(self, data):
+        return f"id: {data['version']}\ndata: {json.dumps(data, ensure_ascii = False)}\n\n".encode("UTF-8")
+
+    def subscribe(self):    # → (購読者, 最初に送る全体 or None)
+        subscriber          = Subscriber(self.queueSize)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            full            = self.full
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.run, daemon = True)
+                self.thread.start()
+        self.wake.set()
+        return subscriber, full
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, message):     # 購読者ごとのキューには待たずに入れる (遅い購読者が他を止めない)
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+            except queue.Full:
+                subscriber.drops += 1
+                if subscriber.drops > self.maxDrops:
+                    subscriber.closed = True
+                    self.subscribers.discard(subscriber)
+                    continue
+                try:        # 溜まった差分は捨て、追いついたら全体を送る
+                    while True:
+                        subscriber.queue.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.queue.put_nowait(self.resync)
+
+    def collect(self):
+        web                 = main.WebCGI()
+        snapshot            = web.live_snapshot()
+        common.Histograms().record("main", "hub", web.timer)
+        full                = self.event(web.live_diff(snapshot))
+        with self.lock:
+            previous        = self.snapshot
+            self.snapshot   = snapshot
+            self.full       = full
+            self.cycles     += 1
+            if previous is None:
+                self.publish(full)
+            elif previous["version"] != snapshot["version"]:
+                self.publish(self.event(web.live_diff(snapshot, previous["state"])))
+
+    def run(self):
+        while True:
+            self.wake.clear()
+            if not self.subscribers:    # 誰も見ていなければ集めない
+                self.wake.wait()
+            start           = time.monotonic()
+            try:
+                self.collect()
+            except Exception as e:     # 上流が落ちている間は周期ごとに 1 行だけ残す
+                print(f"live hub: {e}", file = sys.stderr)
+            time.sleep(max(0.0, main.WebCGI.liveInterval - (time.monotonic() - start)))
+
+    def stream(self, keepAlive = 15):
+        subscriber, full    = self.subscribe()
+        try:
+            yield f"retry: {int(main.WebCGI.liveInterval * 1000)}\n\n".encode("UTF-8")
+            if full is not None:
+                yield full
+            while not subscriber.closed:
+                try:
+                    message = subscriber.queue.get(timeout = keepAlive)
+                except queue.Empty:
+                    yield b": keep-alive\n\n"
+                    continue
+                yield self.full if message is self.resync else message
+        finally:
+            self.unsubscribe(subscriber)
+
+hub                         = LiveHub()
+
+def page_main(environ):
+    params                  = request_params(environ)
+    if params.get("url") == "stream":
+        return "200 OK", [
+            ("Content-Type", "text/event-stream; charset=UTF-8"),
+            ("Cache-Control", "no-cache"),
+            ("X-Accel-Buffering", "no")
+        ], hub.stream()
+    return main.WebCGI().respond(params.get("url", "index"), environ, params = params)
+
+def page_info(environ):
+    global infoData
+    with infoLock:
+        if infoData is None:
+            infoData        = info.JSONDataCreate()
+    data                    = infoData.for_request()    # 締め切りと PhaseTimer は共有せず、このリクエストだけのものにする
+    body                    = json.dumps(
+        data.get_data("10688"),
+        ensure_ascii        = False,
+        indent              = 4
+    )
+    return "200 OK", [
+        ("Content-Type", "application/json; charset=UTF-8"),
+        ("Server-Timing", data.timer.header())
+    ], body.encode("UTF-8")
+
+def page_metrics(environ):      # main.py / info.py / LiveHub が積み上げたヒストグラム (Prometheus 形式)
+    return "200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8")], common.Histograms().render().encode("UTF-8")
+
+def page_static(path, environ = {}):
+    if path == "/":
+        path                = "/index.html"
+    if not (path.startswith(staticDirs) or path in staticFiles):
+        return None
+    filePath                = os.path.realpath(os.path.join(rootDir, path.lstrip("/")))
+    if not filePath.startswith(rootDir + os.sep) or not os.path.isfile(filePath):
+        return None
+    headers                 = [("Content-Type", mimetypes.guess_type(filePath)[0] or "application/octet-stream")]
+    if path.startswith(distPrefix):     # 名前に内容のハッシュが入っているので中身は変わらない
+        filePath, encoding  = main.precompressed(filePath, environ.get("HTTP_ACCEPT_ENCODING", ""))
+        headers             += [
+            ("Cache-Control", "public, max-age=31536000, immutable"),
+            ("Vary", "Accept-Encoding")
+        ]
+        if encoding is not None:
+            headers.append(("Content-Encoding", encoding))
+    with open(filePath, "rb") as f:
+        body                = f.read()
+    return "200 OK", headers, body
+
+routes                      = {
+    "/cgi-bin/main.py"      : page_main,
+    "/cgi-bin/info.py"      : page_info,
+    "/metrics"              : page_metrics
+}
+
+def application(environ, start_response):
+    path                    = environ.get("PATH_INFO", "/") or "/"
+    try:
+        if path in routes:
+            response        = routes[path](environ)
+        else:
+            response        = page_static(path, environ)
+    except Exception:
+        traceback.print_exc()
+        response            = "500 Internal Server Error", [("Content-Type", "text/plain; charset=UTF-8")], b"Internal Server Error"
+
+    if response is None:
+        response            = "404 Not Found", [("Content-Type", "text/plain; charset=UTF-8")], b"Not Found"
+
+    status, headers, body   = response
+    if not isinstance(body, bytes):     # ストリーム (SSE) はそのまま流す
+        start_response(status, headers)
+        return body
+    if not any(name == "Content-Length" for name, value in headers):
+        headers             = headers + [("Content-Length", str(len(body)))]
+    start_response(status, headers)
+    return [body]
+
+def serve(host = "0.0.0.0", port = 8000, workers = 1):
+    server                  = make_server(
+        host,
+        port,
+        application,
+        server_class        = ThreadingWSGIServer,
+        handler_class       = QuietHandler
+    )
+    for name in ("requests", "psutil"):     # CGI では遅延 import しているものを先に読み込んでおく
+        importlib.import_module(name)
+    if workers <= 1 or not hasattr(os, "fork"):
+        server.serve_forever()
+        return
+
+    # pre-fork : 待ち受けソケットとインポート済みのモジュールを子プロセスで共有する
+    children                = []
+    for _ in range(workers):
+        pid                 = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum = None, frame = None):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        stop()
+
+if __name__ == "__main__":
+    parser                  = argparse.ArgumentParser(description = "WebCGI を常駐プロセスで配信する")
+    parser.add_argument("--host", default = "0.0.0.0")
+    parser.add_argument("--port", type = int, default = 8000)
+    parser.add_argument("--workers", type = int, default = 1, help = "pre-fork するワーカープロセス数")
+    parser.add_argument("--interval", type = float, default = main.WebCGI.liveInterval, help = "ライブ更新の間隔 (秒)")
+    parser.add_argument("--deadline", type = float, default = info.JSONDataCreate.budget, help = "info.py が上流を待つ秒数の上限")
+    args                    = parser.parse_args()
+
+    main.WebCGI.liveInterval = args.interval
+    info.JSONDataCreate.budget = args.deadline
+
+    serve(args.host, args.port, args.workers)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# CGI (debug.py と同じ httpcgi) と常駐アプリ (app.py) の requests/秒 を比較する
+# python benchmark/app_rps.py [秒数] [同時接続数] [app.py のワーカー数]
+
+import os, sys, time, tempfile, threading, subprocess
+import requests
+from standins import StandInServer, ZabbixHandler
+
+rootDir                     = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def wait_ready(url, timeout = 15):
+    limit                   = time.time() + timeout
+    while time.time() < limit:
+        try:
+            requests.get(url, timeout = 1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start: {url}")
+
+def hammer(url, seconds, clients):
+    counts                  = [0] * clients
+    errors                  = [0] * clients
+    stopAt                  = time.time() + seconds
+
+    def client(index):
+        session             = requests.Session()
+        while time.time() < stopAt:
+            try:
+                r           = session.get(url, timeout = 30)
+                r.raise_for_status()
+                counts[index] += 1
+            except requests.RequestException:
+                errors[index] += 1
+
+    threads                 = [threading.Thread(target = client, args = (i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / seconds, sum(errors)
+
+def run(name, command, env, port, seconds, clients):
+    proc                    = subprocess.Popen(command, cwd = rootDir, env = env, stderr = subprocess.DEVNULL)
+    try:
+        url                 = f"http://127.0.0.1:{port}/cgi-bin/main.py"
+        wait_ready(url)
+        rps, errors         = hammer(url, seconds, clients)
+        print(f"{name:<24}: {rps:8.1f} req/s  errors={errors}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+if __name__ == "__main__":
+    seconds                 = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    clients                 = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    workers                 = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    zabbix                  = StandInServer(ZabbixHandler).start()
+    tokenDir                = tempfile.mkdtemp()
+    with open(os.path.join(tokenDir, "zabbix.token"), "w", encoding="UTF-8") as token:
+        token.write("benchmark")
+
+    env                     = os.environ.copy()
+    env.update({
+        "CGITEST_TOKEN_DIR" : tokenDir,
+        "CGITEST_CACHE_DIR" : tempfile.mkdtemp(),
+        "CGITEST_ZABBIX_URL": f"{zabbix.url}/api_jsonrpc.php",
+    })
+
+    run(
+        "CGI (httpcgi)",
+        [sys.executable, "-c", "import sys; from httpcgi import CGIHTTP; CGIHTTP('127.0.0.1', int(sys.argv[1])).serve_forever()", "8101"],
+        env, 8101, seconds, clients
+    )
+    run(
+        "app.py (1 process)",
+        [sys.executable, "app.py", "--host", "127.0.0.1", "--port", "8102"],
+        env, 8102, seconds, clients
+    )
+    run(
+        f"app.py ({workers} workers)",
+        [sys.executable, "app.py", "--host", "127.0.0.1", "--port", "8103", "--workers", str(workers)],
+        env, 8103, seconds, clients
+    )
+    zabbix.stop()
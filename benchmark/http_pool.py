@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+# requests.post (毎回新規接続) と http_session (keep-alive 接続プール) の 1 回あたりの差を測る
+# python benchmark/http_pool.py [回数]
+
+import os, sys, json, time, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
+import requests
+from common import http_session
+
+class StandInHandler(BaseHTTPRequestHandler):   # Zabbix API の代わりに固定の JSON を返す
+    protocol_version        = "HTTP/1.1"        # keep-alive を有効にする
+    disable_nagle_algorithm = True              # ヘッダと本文の分割送信で遅延 ACK 待ちにならないように
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body                = json.dumps({"jsonrpc": "2.0", "result": [], "id": 1}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def measure(post, url, count):
+    payload                 = {"jsonrpc": "2.0", "method": "item.get", "params": {}, "id": 1}
+    post(url, json = payload, timeout = 5)      # ウォームアップ
+    start                   = time.perf_counter()
+    for _ in range(count):
+        post(url, json = payload, timeout = 5).json()
+    return (time.perf_counter() - start) / count
+
+if __name__ == "__main__":
+    count                   = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    server                  = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    url                     = f"http://127.0.0.1:{server.server_port}/api_jsonrpc.php"
+
+    fresh                   = measure(requests.post, url, count)
+    pooled                  = measure(http_session("benchmark").post, url, count)
+    server.shutdown()
+
+    print(f"requests.post : {fresh * 1000:8.3f} ms/call")
+    print(f"http_session  : {pooled * 1000:8.3f} ms/call")
+    print(f"saving        : {(fresh - pooled) * 1000:8.3f} ms/call ({(1 - pooled / fresh) * 100:.1f}%)")
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# 閲覧者数を増やしたときの上流 (Zabbix) への問い合わせ数とサーバの CPU 時間を測る
+# stream : app.py の SSE (?url=stream) を購読する。集めるのは LiveHub の 1 周期に 1 回だけ
+# poll   : 各閲覧者が ?url=live を interval ごとに取りに行く (CGI と同じ動き)
+# python benchmark/hub_load.py [--viewers 1 10 100 500] [--mode stream poll] [--seconds 10] [--interval 1] [--stalled 0]
+
+import os, sys, time, socket, argparse, tempfile, selectors, threading, subprocess
+import psutil, requests
+from standins import StandInServer, ZabbixHandler
+
+rootDir                     = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def wait_ready(url, timeout = 15):
+    limit                   = time.time() + timeout
+    while time.time() < limit:
+        try:
+            requests.get(url, timeout = 1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start: {url}")
+
+class StreamViewers:    # SSE の購読者を 1 スレッドの selector でまとめて動かす
+    def __init__(self, port, count, stalled = 0):
+        self.selector       = selectors.DefaultSelector()
+        self.events         = {}
+        self.buffers        = {}
+        self.stalled        = []        # 接続したまま読まない (遅いクライアント)
+        self.stop           = threading.Event()
+        for index in range(count + stalled):
+            sock            = socket.create_connection(("127.0.0.1", port))
+            sock.sendall(b"GET /cgi-bin/main.py?url=stream HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n")
+            if index >= count:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+                self.stalled.append(sock)
+                continue
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ)
+            self.events[sock] = 0
+            self.buffers[sock] = b""
+        self.thread         = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop.is_set():
+            for key, _ in self.selector.select(timeout = 0.2):
+                sock        = key.fileobj
+                try:
+                    data    = sock.recv(65536)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    self.selector.unregister(sock)
+                    continue
+                *chunks, self.buffers[sock] = (self.buffers[sock] + data).split(b"\n\n")
+                self.events[sock] += sum(1 for chunk in chunks if b"\ndata: " in b"\n" + chunk)
+
+    def received(self):
+        return sum(self.events.values())
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        for sock in list(self.events) + self.stalled:
+            sock.close()
+
+class PollViewers:      # ?url=live を interval ごとに取りに行く閲覧者
+    def __init__(self, port, count, interval):
+        self.url            = f"http://127.0.0.1:{port}/cgi-bin/main.py"
+        self.interval       = interval
+        self.responses      = [0] * count
+        self.stop           = threading.Event()
+        self.threads        = [threading.Thread(target = self.run, args = (i,), daemon = True) for i in range(count)]
+        for t in self.threads:
+            t.start()
+
+    def run(self, index):
+        session             = requests.Session()
+        since               = ""
+        time.sleep(self.interval * index / len(self.responses))    # 一斉に来ないようにずらす
+        while not self.stop.is_set():
+            start           = time.monotonic()
+            try:
+                since       = session.get(self.url, params = {"url": "live", "since": since}, timeout = 30).json()["version"]
+                self.responses[index] += 1
+            except (requests.RequestException, ValueError):
+                since       = ""
+            self.stop.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def received(self):
+        return sum(self.responses)
+
+    def close(self):
+        self.stop.set()
+        for t in self.threads:
+            t.join()
+
+def measure(mode, viewers, port, zabbix, server, seconds, interval, stalled):
+    if mode == "stream":
+        clients             = StreamViewers(port, viewers, stalled)
+    else:
+        clients             = PollViewers(port, viewers, interval)
+    time.sleep(interval * 2)    # 接続が揃うまで待つ
+    calls, received         = len(zabbix.calls), clients.received()
+    cpu                     = sum(server.cpu_times()[:2])
+    time.sleep(seconds)
+    calls, received         = len(zabbix.calls) - calls, clients.received() - received
+    cpu                     = sum(server.cpu_times()[:2]) - cpu
+    clients.close()
+    print(
+        f"{mode:<7} {viewers:>7} {calls / seconds:>12.2f} {cpu / seconds * 1000:>14.1f} "
+        f"{received / seconds / viewers * interval:>16.2f}"
+    )
+
+if __name__ == "__main__":
+    parser                  = argparse.ArgumentParser(description = "閲覧者数に対する上流呼び出しとサーバ負荷を測る")
+    parser.add_argument("--viewers", type = int, nargs = "+", default = [1, 10, 100, 500])
+    parser.add_argument("--mode", nargs = "+", choices = ["stream", "poll"], default = ["stream", "poll"])
+    parser.add_argument("--seconds", type = float, default = 10)
+    parser.add_argument("--interval", type = float, default = 1)
+    parser.add_argument("--stalled", type = int, default = 0, help = "stream で読まずに放置する購読者の数")
+    parser.add_argument("--port", type = int, default = 8104)
+    args                    = parser.parse_args()
+
+    zabbix                  = StandInServer(ZabbixHandler).start()
+    tokenDir                = tempfile.mkdtemp()
+    with open(os.path.join(tokenDir, "zabbix.token"), "w", encoding="UTF-8") as token:
+        token.write("benchmark")
+    env                     = os.environ.copy()
+    env.update({
+        "CGITEST_TOKEN_DIR" : tokenDir,
+        "CGITEST_CACHE_DIR" : tempfile.mkdtemp(),
+        "CGITEST_ZABBIX_URL": f"{zabbix.url}/api_jsonrpc.php",
+    })
+
+    proc                    = subprocess.Popen(
+        [sys.executable, "app.py", "--host", "127.0.0.1", "--port", str(args.port), "--interval", str(args.interval)],
+        cwd                 = rootDir,
+        env                 = env
+    )
+    try:
+        wait_ready(f"http://127.0.0.1:{args.port}/index.html")
+        server              = psutil.Process(proc.pid)
+        print(f"{'mode':<7} {'viewers':>7} {'zabbix/sec':>12} {'server cpu ms/s':>14} {'updates/interval':>16}")
+        for mode in args.mode:
+            for viewers in args.viewers:
+                measure(mode, viewers, args.port, zabbix, server, args.seconds, args.interval, args.stalled)
+    finally:
+        proc.terminate()
+        proc.wait()
+        zabbix.stop()
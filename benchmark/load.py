@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# ローカルで起動したサーバ (debug.py の CGI か app.py) に、決まった到着率でリクエストを送り続けて処理能力を測る
+# 上流 (Zabbix / 天気 / 為替) は standins.py の代役にする。到着は応答を待たないポアソン過程 (open-loop)
+# python benchmark/load.py --server debug --rates 2 5 10 --mix index=6 info=3 static=1
+# python benchmark/load.py --server app --rates 20 50 100 --seconds 30 --save load.json
+# python benchmark/load.py --url http://raspi.lan:8000 --rates 5         起動済みのサーバに送る (上流は本物)
+
+import os, sys, json, time, queue, random, argparse, tempfile, threading, subprocess
+import requests
+from standins import StandInServer, ZabbixHandler, WeatherHandler, fx_stub
+
+rootDir                     = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+profiles                    = {     # 名前 → URL の候補 (static はハッシュ付きのビルドがあればそちらを使う)
+    "index"                 : ["/cgi-bin/main.py"],
+    "live"                  : ["/cgi-bin/main.py?url=live"],
+    "info"                  : ["/cgi-bin/info.py"],
+    "static"                : ["/view/js/bootstrap.bundle.min.js", "/view/js/live.js", "/template/css/index.css", "/img/PEN.ico"]
+}
+
+def wait_ready(url, timeout = 15):
+    limit                   = time.time() + timeout
+    while time.time() < limit:
+        try:
+            requests.get(url, timeout = 1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start: {url}")
+
+def static_paths():         # build_static.py の manifest があればハッシュ付きの URL (本番と同じ配信経路) にする
+    try:
+        with open(os.path.join(rootDir, "view", "dist", "manifest.json"), "r", encoding="UTF-8") as f:
+            manifest        = json.load(f)
+    except (OSError, ValueError):
+        return profiles["static"]
+    return sorted(set(manifest.values()))
+
+def start_server(kind, port, env):
+    if kind == "debug":     # debug.py と同じ AssetHandler をポートだけ変えて起動する
+        command             = [
+            sys.executable, "-c",
+            "import sys, debug; from httpcgi import CGIHTTP; CGIHTTP('127.0.0.1', int(sys.argv[1]), debug.AssetHandler).serve_forever()",
+            str(port)
+        ]
+    else:
+        command             = [sys.executable, "app.py", "--host", "127.0.0.1", "--port", str(port)]
+    return subprocess.Popen(command, cwd = rootDir, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+def stub_upstreams():       # → (代役サーバ, サーバに渡す環境変数)
+    zabbix                  = StandInServer(ZabbixHandler).start()
+    weather                 = StandInServer(WeatherHandler).start()
+    workDir                 = tempfile.mkdtemp(prefix = "cgitest-load-")
+    with open(os.path.join(workDir, "zabbix.token"), "w", encoding="UTF-8") as token:
+        token.write("benchmark")
+    env                     = os.environ.copy()
+    env.update({
+        "CGITEST_TOKEN_DIR"     : workDir,
+        "CGITEST_CACHE_DIR"     : os.path.join(workDir, "cache"),
+        "CGITEST_ZABBIX_URL"    : f"{zabbix.url}/api_jsonrpc.php",
+        "CGITEST_WEATHER_URL"   : f"{weather.url}/api/forecast/city/",
+        "CGITEST_FX_SOURCE"     : fx_stub(workDir)
+    })
+    return [zabbix, weather], env
+
+def percentile(samples, p):     # samples は並べ替え済み (最近傍順位法)
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, int(round(p / 100 * len(samples))) - 1))]
+
+def run_load(baseURL, rate, seconds, mix, workers, timeout):
+    # 到着時刻は先に決めておき、遅れて送ったぶんも待ち時間として応答時間に含める (coordinated omission を避ける)
+    names                   = [name for name, weight in mix for _ in range(weight)]
+    arrivals                = queue.Queue()
+    results                 = []        # (profile, 応答時間 秒, 成功か)
+    lock                    = threading.Lock()
+    rng                     = random.Random(rate)
+
+    def worker():
+        session             = requests.Session()
+        while True:
+            item            = arrivals.get()
+            if item is None:
+                return
+            scheduled, name, path = item
+            try:
+                r           = session.get(baseURL + path, timeout = timeout)
+                ok          = r.status_code < 400
+            except requests.RequestException:
+                ok          = False
+            with lock:
+                results.append((name, time.perf_counter() - scheduled, ok))
+
+    threads                 = [threading.Thread(target = worker, daemon = True) for _ in range(workers)]
+    for t in threads:
+        t.start()
+
+    start                   = time.perf_counter()
+    arrival                 = start
+    sent                    = {}        # profile → 送った数
+    while arrival < start + seconds:
+        delay               = arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        name                = rng.choice(names)
+        arrivals.put((arrival, name, rng.choice(profiles[name])))
+        sent[name]          = sent.get(name, 0) + 1
+        arrival             += rng.expovariate(rate)
+    for _ in threads:
+        arrivals.put(None)
+    limit                   = time.perf_counter() + timeout     # 最後に送った分が timeout で終わるまで待つ
+    for t in threads:
+        t.join(max(0.0, limit - time.perf_counter()))
+    elapsed                 = time.perf_counter() - start
+    with lock:
+        finished            = list(results)
+
+    report                  = {}
+    for name in ["all"] + sorted({name for name, weight in mix}):
+        latencies           = sorted(l for n, l, ok in finished if ok and name in ("all", n))
+        errors              = sum(1 for n, l, ok in finished if not ok and name in ("all", n))
+        count               = sum(sent.values()) if name == "all" else sent.get(name, 0)
+        unfinished          = count - sum(1 for n, l, ok in finished if name in ("all", n))
+        report[name]        = {
+            "requests"      : count,
+            "throughput"    : round(len(latencies) / elapsed, 2),
+            "error_rate"    : round((errors + unfinished) / count, 4) if count else 0.0,     # 待ちきれなかった分も失敗に数える
+            "unfinished"    : unfinished,
+            "p50_ms"        : None if not latencies else round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms"        : None if not latencies else round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms"        : None if not latencies else round(percentile(latencies, 99) * 1000, 2)
+        }
+    return report
+
+def parse_mix(items):       # ["index=6", "info=3"] → [("index", 6), ("info", 3)]
+    mix                     = []
+    for item in items:
+        name, _, weight     = item.partition("=")
+        if name not in profiles:
+            raise SystemExit(f"unknown profile: {name} ({', '.join(profiles)})")
+        mix.append((name, int(weight or 1)))
+    return mix
+
+if __name__ == "__main__":
+    parser                  = argparse.ArgumentParser(description = "到着率を決めてリクエストを送り、スループットと応答時間の分布を測る")
+    parser.add_argument("--server", choices = ["debug", "app"], default = "debug", help = "起動するサーバ (debug.py の CGI / app.py)")
+    parser.add_argument("--url", help = "起動済みのサーバに送る (--server と代役は使わない)")
+    parser.add_argument("--port", type = int, default = 8105)
+    parser.add_argument("--rates", type = float, nargs = "+", default = [2, 5, 10], help = "1 秒あたりの到着数 (順に測る)")
+    parser.add_argument("--seconds", type = float, default = 20)
+    parser.add_argument("--mix", nargs = "+", default = ["index=6", "info=3", "static=1"], help = "プロファイル=重み")
+    parser.add_argument("--workers", type = int, default = 64, help = "同時に送るリクエストの上限")
+    parser.add_argument("--timeout", type = float, default = 30)
+    parser.add_argument("--save", help = "結果を JSON で保存する")
+    args                    = parser.parse_args()
+
+    mix                     = parse_mix(args.mix)
+    profiles["static"]      = static_paths()
+    standIns, proc          = [], None
+    if args.url:
+        baseURL             = args.url.rstrip("/")
+    else:
+        standIns, env       = stub_upstreams()
+        baseURL             = f"http://127.0.0.1:{args.port}"
+        proc                = start_server(args.server, args.port, env)
+
+    results                 = {}
+    try:
+        wait_ready(baseURL + "/index.html")
+        for name, weight in mix:    # 初回だけ重い処理 (キャッシュ作成など) を測定から外す
+            requests.get(baseURL + profiles[name][0], timeout = args.timeout)
+        print(f"{'rate':>6} {'profile':<8} {'requests':>8} {'req/s':>8} {'errors':>7} {'unfin':>5} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for rate in args.rates:
+            report          = run_load(baseURL, rate, args.seconds, mix, args.workers, args.timeout)
+            results[str(rate)] = report
+            for name, r in report.items():
+                latency     = " ".join("        -" if r[key] is None else f"{r[key]:7.1f}ms" for key in ("p50_ms", "p95_ms", "p99_ms"))
+                print(f"{rate:>6g} {name:<8} {r['requests']:>8} {r['throughput']:>8.1f} {r['error_rate'] * 100:>6.1f}% {r['unfinished']:>5} {latency}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        for server in standIns:
+            server.stop()
+
+    if args.save:
+        with open(args.save, "w", encoding="UTF-8") as f:
+            json.dump({
+                "server"    : args.url or args.server,
+                "mix"       : dict(mix),
+                "seconds"   : args.seconds,
+                "results"   : results
+            }, f, indent = 4)
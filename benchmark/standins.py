@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# ベンチマーク用に外部 API の代わりをするローカルサーバ
+
+import os, json, time, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StandInServer:
+    def __init__(self, handler):
+        self.server         = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.calls   = []
+        self.thread         = threading.Thread(target = self.server.serve_forever, daemon = True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def calls(self):
+        return self.server.calls
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class JSONHandler(BaseHTTPRequestHandler):
+    protocol_version        = "HTTP/1.1"
+    disable_nagle_algorithm = True      # ヘッダと本文の分割送信で遅延 ACK 待ちにならないように
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status = 200):
+        body                = json.dumps(data, ensure_ascii = False).encode("UTF-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class ZabbixHandler(JSONHandler):   # item.get / history.get だけを実装した Zabbix JSON-RPC
+    items                   = {     # (hostid, key_) : (itemid, value_type, value)
+        ("10084", "outside.temp")       : ("1001", "0", "21.5"),
+        ("10084", "outside.hum")        : ("1002", "0", "55.0"),
+        ("10688", "cpu.temp")           : ("1003", "0", "48.2"),
+        ("10688", "system.hostname")    : ("1004", "1", "raspi5"),
+    }
+    delay                   = 0.0
+
+    def do_POST(self):
+        request             = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self.server.calls.append(request["method"])
+        time.sleep(self.delay)
+        params              = request.get("params", {})
+        if request["method"] == "item.get":
+            result          = self.item_get(params)
+        elif request["method"] == "history.get":
+            result          = self.history_get(params)
+        else:
+            self.send_json({"jsonrpc": "2.0", "error": {"code": -32601, "message": "Method not found", "data": request["method"]}, "id": request.get("id")})
+            return
+        self.send_json({"jsonrpc": "2.0", "result": result, "id": request.get("id")})
+
+    def as_list(self, value):
+        if value is None:
+            return None
+        return [str(v) for v in value] if isinstance(value, list) else [str(value)]
+
+    def item_get(self, params):
+        hostids             = self.as_list(params.get("hostids"))
+        itemids             = self.as_list(params.get("itemids"))
+        keys                = self.as_list((params.get("filter") or params.get("search") or {}).get("key_"))
+        result              = []
+        for (hostid, key), (itemid, valueType, value) in self.items.items():
+            if (hostids and hostid not in hostids) or (keys and key not in keys) or (itemids and itemid not in itemids):
+                continue
+            result.append({
+                "itemid"    : itemid,
+                "value_type": valueType,
+                "hostid"    : hostid,
+                "key_"      : key,
+                "lastvalue" : value,
+                "lastclock" : str(int(time.time()))
+            })
+        return result
+
+    def history_get(self, params):
+        itemids             = self.as_list(params.get("itemids")) or []
+        result              = [
+            {"itemid": itemid, "clock": str(int(time.time())), "value": value}
+            for itemid, valueType, value in self.items.values()
+            if itemid in itemids and valueType == str(params.get("history"))
+        ]
+        return result[:params["limit"]] if params.get("limit") else result
+
+class WeatherHandler(JSONHandler):  # weather.tsukumijima.net の /api/forecast/city/<地域 ID> (ETag で 304 を返す)
+    publicTime              = "2026-01-01T11:00:00+09:00"
+    forecasts               = [
+        {"telop": "晴れ", "detail": {"weather": "晴れ　時々　くもり"}},
+        {"telop": "曇り", "detail": {"weather": "くもり　夜　雨"}},
+        {"telop": "雨", "detail": {"weather": "雨"}}
+    ]
+    delay                   = 0.0
+
+    def do_GET(self):
+        city                = self.path.rstrip("/").rsplit("/", 1)[-1]
+        self.server.calls.append(city)
+        time.sleep(self.delay)
+        etag                = f'"{city}-{self.publicTime}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body                = json.dumps({
+            "publicTime"    : self.publicTime,
+            "location"      : {"city": city},
+            "forecasts"     : self.forecasts
+        }, ensure_ascii = False).encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def fx_stub(directory, quotes = {"USDJPY=X": 150.0}):   # info.py の CGITEST_FX_SOURCE に渡す値 (Yahoo の代わりにファイルから読む)
+    path                    = os.path.join(directory, "fx_quotes_stub.json")
+    with open(path, "w", encoding="UTF-8") as f:
+        json.dump(quotes, f)
+    return f"file:{path}"
+
+def synthetic_processes(count, seed = 1):   # psutil の代わりのプロセス一覧 [(pid, 名前, CPU%, RSS MB)] (同じ count なら毎回同じ)
+    names                   = ("python3", "nginx", "zabbix_agentd", "chromium", "sshd", "systemd", "node", "postgres")
+    rows                    = []
+    for pid in range(seed, seed + count):
+        rows.append((
+            pid,
+            f"{names[pid % len(names)]}-{pid % 97}",
+            (pid * 7919 % 1000) / 100,
+            (pid * 104729 % 900) + 0.5 if pid % 25 == 0 else (pid * 104729 % 120) + 0.5   # 大きいのは一部だけ (警告は数件)
+        ))
+    return rows
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# CGI スクリプトの起動 (import) コストをモジュール単位で計測する
+# python benchmark/startup.py                          main / info の import 時間を表示
+# python benchmark/startup.py --save base.json         結果を保存
+# python benchmark/startup.py --compare base.json      保存した結果との差分を表示 (悪化していれば終了コード 1)
+# python benchmark/startup.py --budget-ms 150          import 合計が予算を超えたら終了コード 1
+# PYTHONPROFILEIMPORTTIME=1 で動かしたサーバのログも --log で集計できる
+
+import os, sys, json, argparse, subprocess
+
+rootDir                     = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+cgiDir                      = os.path.join(rootDir, "cgi-bin")
+
+def parse_importtime(text):     # -X importtime の出力 → [(モジュール名, self µs, cumulative µs, 深さ)] (出力順)
+    modules                 = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            selfTime, cumulative, name = line[len("import time:"):].split("|", 2)
+            depth           = (len(name) - len(name.lstrip(" ")) - 1) // 2
+            modules.append((name.strip(), int(selfTime), int(cumulative), depth))
+        except ValueError:
+            continue
+    return modules
+
+def subtree(modules, target):   # 子モジュールは親より先に出力されるので、target の直前から深さで遡る
+    for index, (name, selfTime, cumulative, depth) in enumerate(modules):
+        if name == target:
+            tree            = {name : (selfTime, cumulative, 0)}
+            for child in reversed(modules[:index]):
+                if child[3] <= depth:
+                    break
+                tree[child[0]] = (child[1], child[2], child[3] - depth)
+            return tree
+    return {}
+
+def profile(module, repeat = 5):    # 一番速かった回 (= ディスクキャッシュ等の揺らぎが少ない回) を採用する
+    best                    = None
+    for _ in range(repeat):
+        result              = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {cgiDir!r}); import {module}"],
+            capture_output  = True,
+            text            = True,
+            cwd             = cgiDir
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+        modules             = subtree(parse_importtime(result.stderr), module)
+        if best is None or modules.get(module, (0, 0, 0))[1] < best.get(module, (0, 0, 0))[1]:
+            best            = modules
+    return best
+
+def report(name, modules, top = 15):
+    total                   = modules.get(name, (0, 0, 0))[1]
+    print(f"== {name}: {total / 1000:.1f} ms cumulative")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    children                = [(m, v) for m, v in modules.items() if v[2] == 1 or m == name]
+    for module, (selfTime, cumulative, depth) in sorted(children, key = lambda mv: -mv[1][1])[:top]:
+        print(f"{cumulative / 1000:10.1f}ms {selfTime / 1000:8.1f}ms  {module}")
+    print()
+    return total
+
+if __name__ == "__main__":
+    parser                  = argparse.ArgumentParser(description = "CGI スクリプトの import コストを計測する")
+    parser.add_argument("modules", nargs = "*", default = ["main", "info"])
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--top", type = int, default = 15)
+    parser.add_argument("--budget-ms", type = float, help = "各モジュールの import 時間の上限")
+    parser.add_argument("--save", help = "結果を JSON で保存する")
+    parser.add_argument("--compare", help = "保存した JSON と比較する")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "比較時に許す悪化率")
+    parser.add_argument("--log", help = "PYTHONPROFILEIMPORTTIME=1 の出力を含むログを集計する")
+    args                    = parser.parse_args()
+
+    if args.log:
+        with open(args.log, "r", encoding="UTF-8", errors="replace") as f:
+            modules         = parse_importtime(f.read())
+        for module, selfTime, cumulative, depth in sorted(modules, key = lambda m: -m[2])[:args.top]:
+            print(f"{cumulative / 1000:10.1f}ms {selfTime / 1000:8.1f}ms  {module}")
+        sys.exit()
+
+    totals                  = {}
+    for module in args.modules:
+        totals[module]      = report(module, profile(module, args.repeat), args.top)
+
+    failed                  = False
+    if args.budget_ms is not None:
+        for module, total in totals.items():
+            if total / 1000 > args.budget_ms:
+                print(f"over budget: {module} {total / 1000:.1f} ms > {args.budget_ms} ms")
+                failed      = True
+
+    if args.compare:
+        with open(args.compare, "r", encoding="UTF-8") as f:
+            baseline        = json.load(f)
+        for module, total in totals.items():
+            if module not in baseline:
+                continue
+            ratio           = total / max(1, baseline[module])
+            print(f"{module}: {baseline[module] / 1000:.1f} ms -> {total / 1000:.1f} ms ({(ratio - 1) * 100:+.0f}%)")
+            if ratio > 1 + args.tolerance:
+                failed      = True
+
+    if args.save:
+        with open(args.save, "w", encoding="UTF-8") as f:
+            json.dump(totals, f, indent = 4)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# 上流 (Zabbix / 天気 / 為替) とプロセス一覧をすべてローカルの代役にして、描画と取得の処理時間を測る
+# python benchmark/suite.py                              全ケースを測って表示
+# python benchmark/suite.py --processes 5000            プロセス数を変える
+# python benchmark/suite.py --latency-ms 20             代役サーバの応答を遅らせる
+# python benchmark/suite.py --save base.json            結果を JSON で保存
+# python benchmark/suite.py --compare base.json         保存した結果との差分を表示 (悪化していれば終了コード 1)
+
+import os, sys, json, time, argparse, platform, tempfile, statistics
+from standins import StandInServer, ZabbixHandler, WeatherHandler, fx_stub, synthetic_processes
+
+rootDir                     = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def prepare(processes, latency):    # 代役を立ててから main / info を import する (接続先は import 時に環境変数から読む)
+    ZabbixHandler.delay     = latency
+    WeatherHandler.delay    = latency
+    zabbix                  = StandInServer(ZabbixHandler).start()
+    weather                 = StandInServer(WeatherHandler).start()
+    workDir                 = tempfile.mkdtemp(prefix = "cgitest-bench-")
+    tokenDir                = os.path.join(workDir, "token")
+    os.makedirs(tokenDir)
+    with open(os.path.join(tokenDir, "zabbix.token"), "w", encoding="UTF-8") as token:
+        token.write("benchmark")
+    os.environ.update({
+        "CGITEST_TOKEN_DIR"     : tokenDir,
+        "CGITEST_CACHE_DIR"     : os.path.join(workDir, "cache"),
+        "CGITEST_ZABBIX_URL"    : f"{zabbix.url}/api_jsonrpc.php",
+        "CGITEST_WEATHER_URL"   : f"{weather.url}/api/forecast/city/",
+        "CGITEST_FX_SOURCE"     : fx_stub(workDir)
+    })
+    sys.path.insert(0, os.path.join(rootDir, "cgi-bin"))
+    import main
+    main.ProcessSnapshot().write(synthetic_processes(processes), interval = 3600)     # 測っている間は期限切れにしない
+    return zabbix, weather
+
+def cases():                # ケース名 → 1 回分の処理
+    import main, info
+    web                     = main.WebCGI()
+    data                    = info.JSONDataCreate()
+    data.get_data()         # キャッシュを温める
+    return {
+        "gauge_create"          : lambda: web.gauge_create(radius = 20, value = "21.50℃", valuePercent = 0.52, scales = [-20, 0, 20, 30, 35, 45, 60]),
+        "html_body"             : lambda: main.WebCGI().html_body(),
+        "urls.index"            : lambda: main.WebCGI().urls("index"),
+        "urls.live"             : lambda: main.WebCGI().urls("live"),
+        "get_data.cached"       : lambda: data.get_data(),
+        "get_data.uncached"     : lambda: data.get_data(useCache = False)
+    }
+
+def measure(function, repeat, warmup = 3):  # → 1 回あたりの時間 (ms) の統計
+    for _ in range(warmup):
+        function()
+    samples                 = []
+    for _ in range(repeat):
+        start               = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "median_ms"         : round(statistics.median(samples), 4),
+        "p95_ms"            : round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "min_ms"            : round(samples[0], 4),
+        "runs"              : repeat
+    }
+
+if __name__ == "__main__":
+    parser                  = argparse.ArgumentParser(description = "上流を代役にして描画と取得の処理時間を測る")
+    parser.add_argument("cases", nargs = "*", help = "測るケース (省略時は全部)")
+    parser.add_argument("--processes", type = int, default = 500, help = "合成するプロセス数")
+    parser.add_argument("--latency-ms", type = float, default = 0, help = "代役サーバの応答の遅れ")
+    parser.add_argument("--repeat", type = int, default = 50)
+    parser.add_argument("--save", help = "結果を JSON で保存する")
+    parser.add_argument("--compare", help = "保存した JSON と比較する")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "比較時に許す悪化率 (中央値)")
+    args                    = parser.parse_args()
+
+    zabbix, weather         = prepare(args.processes, args.latency_ms / 1000)
+    try:
+        available           = cases()
+        names               = args.cases or list(available)
+        results             = {}
+        print(f"{'case':<20} {'median':>10} {'p95':>10} {'min':>10}")
+        for name in names:
+            if name not in available:
+                parser.error(f"unknown case: {name} ({', '.join(available)})")
+            results[name]   = measure(available[name], args.repeat)
+            print(f"{name:<20} {results[name]['median_ms']:8.3f}ms {results[name]['p95_ms']:8.3f}ms {results[name]['min_ms']:8.3f}ms")
+    finally:
+        zabbix.stop()
+        weather.stop()
+
+    report                  = {
+        "meta"              : {
+            "python"        : platform.python_version(),
+            "machine"       : platform.machine(),
+            "processes"     : args.processes,
+            "latency_ms"    : args.latency_ms,
+            "time"          : time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        },
+        "results"           : results
+    }
+
+    failed                  = False
+    if args.compare:
+        with open(args.compare, "r", encoding="UTF-8") as f:
+            baseline        = json.load(f)
+        if baseline["meta"]["processes"] != args.processes or baseline["meta"]["latency_ms"] != args.latency_ms:
+            print(f"note: baseline was taken with {baseline['meta']['processes']} processes / {baseline['meta']['latency_ms']} ms latency")
+        for name, result in results.items():
+            if name not in baseline["results"]:
+                continue
+            before          = baseline["results"][name]["median_ms"]
+            ratio           = result["median_ms"] / max(1e-6, before)
+            print(f"{name}: {before:.3f} ms -> {result['median_ms']:.3f} ms ({(ratio - 1) * 100:+.0f}%)")
+            if ratio > 1 + args.tolerance:
+                failed      = True
+
+    if args.save:
+        with open(args.save, "w", encoding="UTF-8") as f:
+            json.dump(report, f, indent = 4, ensure_ascii = False)
+
+    sys.exit(1 if failed else 0)
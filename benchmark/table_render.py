@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# プロセス表の描画 : markdown 経由 (旧実装) と WebCGI.table_create の比較
+# python benchmark/table_render.py [繰り返し回数]
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cgi-bin"))
+from main import WebCGI
+
+def synthetic_rows(count):
+    rows                    = []
+    for pid in range(1, count + 1):
+        mem                 = (pid * 37) % 700
+        style               = "bg-danger text-black fw-bold" if mem > 500 else "bg-warning text-black fw-bold" if mem > 200 else ""
+        rows.append((pid, f"process-{pid}"[:16], f"{(pid % 13) / 3:.2f}%", (f"{mem:.2f}MB", style), "80, 443" if pid % 50 == 0 else ""))
+    return rows
+
+def render_markdown(md, rows):  # 旧実装 : 文字列を += で連結 → markdown 変換 → str.replace でクラスを付与
+    table                   = """| PID | NAME | CPU | メモリ | Port |
+| -   |  -   | -   | -      | - |
+"""
+    for pid, name, cpu, (mem, style), port in rows:
+        table               += f"""| {pid} | {name} | {cpu} | <span class="{style}">{mem}</span> | {port} |
+"""
+    return md.reset().convert(table).replace(
+        "<table>",
+        """<table class= "table table-bordered table-striped">"""
+    ).replace(
+        "<td>",
+        """<td class="text-nowrap">"""
+    )
+
+def timeit(function, repeat):
+    start                   = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+if __name__ == "__main__":
+    repeat                  = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    cgi                     = WebCGI.__new__(WebCGI)        # テンプレートやトークンは不要なので初期化しない
+    try:
+        import markdown
+        md                  = markdown.Markdown(extensions=["extra", "tables", "attr_list"])
+    except ImportError:
+        md                  = None
+
+    print(f"{'rows':>6} {'markdown':>12} {'table_create':>14} {'speedup':>8}")
+    for count in (100, 1000, 5000):
+        rows                = synthetic_rows(count)
+        direct              = timeit(lambda: cgi.table_create(["PID", "NAME", "CPU", "メモリ", "Port"], rows), repeat)
+        if md is None:
+            print(f"{count:>6} {'-':>12} {direct * 1000:12.2f}ms")
+            continue
+        viaMarkdown         = timeit(lambda: render_markdown(md, rows), repeat)
+        print(f"{count:>6} {viaMarkdown * 1000:10.2f}ms {direct * 1000:12.2f}ms {viaMarkdown / direct:7.1f}x")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# 静的ファイルのビルド : styleConfig.html の CSS を 1 つにまとめ、使っていない Bootstrap のルールを落とし、
+# 内容ハッシュ付きのファイル名と .gz / .br を view/dist/ に書き出す
+# python build_static.py [--no-purge]
+# 結果は view/dist/manifest.json (元 URL → ハッシュ付き URL) と template/html/styleConfig.dist.html
+
+import os, re, sys, glob, gzip, json, hashlib, argparse
+
+rootDir                     = os.path.dirname(os.path.abspath(__file__))
+templateDir                 = os.path.join(rootDir, "template", "html")
+distDir                     = os.path.join(rootDir, "view", "dist")
+distURL                     = "/view/dist/"
+assets                      = (     # CSS 以外でハッシュ付きにするもの
+    "/view/js/bootstrap.bundle.min.js",
+    "/view/js/loading.js",
+    "/view/js/live.js",
+    "/img/PEN.ico"
+)
+usageSources                = (     # クラス名を拾うファイル (Bootstrap の JS が付け外しするクラスも含める)
+    "template/html/*.html",
+    "cgi-bin/*.py",
+    "view/js/*.js",
+    "index.html"
+)
+
+stylesheetLink              = re.compile(r'[ \t]*<link href="([^"]+)" rel="stylesheet">\n?')
+comment                     = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|(/\*!.*?\*/)|/\*.*?\*/', re.S)
+className                   = re.compile(r"\.(-?[_a-zA-Z][\w-]*)")
+negation                    = re.compile(r":not\([^()]*\)")
+groupRules                  = ("@media", "@supports", "@layer", "@container")
+
+def local_path(url):
+    return os.path.join(rootDir, url.lstrip("/"))
+
+def skip_string(text, i):       # text[i] の引用符に対応する閉じ引用符の次の位置
+    quote                   = text[i]
+    i                       += 1
+    while i < len(text) and text[i] != quote:
+        i                   += 2 if text[i] == "\\" else 1
+    return i + 1
+
+def parse_rules(text, i = 0):   # → ([(prelude, body)], 終了位置)  body は宣言の文字列 / 入れ子のルール / None (文)
+    rules                   = []
+    start                   = i
+    while i < len(text):
+        c                   = text[i]
+        if c in "\"'":
+            i               = skip_string(text, i)
+            continue
+        if c == ";":
+            rules.append((text[start:i].strip(), None))
+            start           = i + 1
+        elif c == "{":
+            prelude         = text[start:i].strip()
+            if prelude.startswith(groupRules):
+                body, i     = parse_rules(text, i + 1)
+            else:           # @keyframes なども含めて対応する } までをそのまま持つ
+                depth, j    = 1, i + 1
+                while depth:
+                    if text[j] in "\"'":
+                        j   = skip_string(text, j)
+                        continue
+                    depth   += {"{": 1, "}": -1}.get(text[j], 0)
+                    j       += 1
+                body, i     = re.sub(r"\s*\n\s*", "", text[i + 1:j - 1]).strip(), j - 1
+            rules.append((prelude, body))
+            start           = i + 1
+        elif c == "}":
+            return rules, i
+        i                   += 1
+    return rules, i
+
+def split_selectors(prelude):   # カンマ区切り (括弧の中のカンマは区切らない)
+    selectors, depth, start = [], 0, 0
+    for i, c in enumerate(prelude):
+        depth               += {"(": 1, ")": -1}.get(c, 0)
+        if c == "," and depth == 0:
+            selectors.append(prelude[start:i].strip())
+            start           = i + 1
+    selectors.append(prelude[start:].strip())
+    return selectors
+
+def purge(rules, used):         # 使われていないクラスを含むセレクタを落とす (:not() の中は一致に影響しないので見ない)
+    kept                    = []
+    for prelude, body in rules:
+        if body is None:
+            if not prelude.startswith("@charset"):
+                kept.append((prelude, body))
+        elif isinstance(body, list):
+            inner           = purge(body, used)
+            if inner:
+                kept.append((prelude, inner))
+        elif prelude.startswith("@"):
+            kept.append((prelude, body))
+        else:
+            selectors       = [
+                s for s in split_selectors(prelude)
+                if set(className.findall(negation.sub("", s))) <= used
+            ]
+            if selectors:
+                kept.append((",".join(selectors), body))
+    return kept
+
+def serialize(rules):
+    parts                   = []
+    for prelude, body in rules:
+        if body is None:
+            parts.append(f"{prelude};")
+        elif isinstance(body, list):
+            parts.append(f"{' '.join(prelude.split())}{{{serialize(body)}}}")
+        else:
+            parts.append(f"{' '.join(prelude.split())}{{{body}}}")
+    return "\n".join(parts)
+
+def used_names():               # 単語単位で拾う (誤って残す分には表示は崩れない)
+    words                   = set()
+    for pattern in usageSources:
+        for path in glob.glob(os.path.join(rootDir, pattern)):
+            with open(path, "r", encoding="UTF-8", errors="replace") as f:
+                words.update(re.findall(r"[\w-]+", f.read()))
+    return words
+
+def strip_comment(match, licenses):     # 文字列はそのまま、/*! (ライセンス表記) は先頭へ移し、他のコメントは消す
+    if match.group(1):
+        return match.group(1)
+    if match.group(2):
+        licenses.append(match.group(2))
+    return ""
+
+def build_css(urls, usePurge = True):
+    licenses, rules         = [], []
+    for url in urls:
+        with open(local_path(url), "r", encoding="UTF-8") as f:
+            text            = f.read()
+        text                = comment.sub(lambda m: strip_comment(m, licenses), text)
+        rules               += parse_rules(text)[0]
+    if usePurge:
+        rules               = purge(rules, used_names())
+    else:
+        rules               = [r for r in rules if not (r[1] is None and r[0].startswith("@charset"))]
+    return ("@charset \"UTF-8\";\n" + "\n".join(licenses) + "\n" + serialize(rules) + "\n").encode("UTF-8")
+
+def compressors():              # brotli は任意 (無ければ .gz だけ作る)
+    variants                = [(".gz", lambda data: gzip.compress(data, compresslevel = 9, mtime = 0))]
+    try:
+        import brotli
+        variants.append((".br", lambda data: brotli.compress(data, quality = 11)))
+    except ImportError:
+        pass
+    return variants
+
+def fingerprint(url, data):     # name.ext → name.<hash>.ext として書き出し、圧縮版も並べて置く
+    base, ext               = os.path.splitext(os.path.basename(url))
+    name                    = f"{base}.{hashlib.blake2b(data, digest_size = 8).hexdigest()}{ext}"
+    path                    = os.path.join(distDir, name)
+    written                 = [name]
+    with open(path, "wb") as f:
+        f.write(data)
+    for suffix, compress in compressors():
+        packed              = compress(data)
+        if len(packed) < len(data) * 0.9:   # ほとんど縮まないもの (PNG 入りの ico など) は置かない
+            with open(path + suffix, "wb") as f:
+                f.write(packed)
+            written.append(name + suffix)
+    return distURL + name, written
+
+def build(usePurge = True):
+    with open(os.path.join(templateDir, "styleConfig.html"), "r", encoding="UTF-8") as f:
+        styleConfig         = f.read()
+    stylesheets             = stylesheetLink.findall(styleConfig)
+
+    if len(compressors()) == 1:
+        print("brotli が無いので .br は作りません (pip install brotli)", file = sys.stderr)
+    os.makedirs(distDir, exist_ok = True)
+    manifest, written       = {}, {"manifest.json"}
+    css                     = build_css(stylesheets, usePurge)
+    bundleURL, files        = fingerprint("/app.css", css)
+    written.update(files)
+    for url in stylesheets:
+        manifest[url]       = bundleURL
+    for url in assets:
+        with open(local_path(url), "rb") as f:
+            manifest[url], files = fingerprint(url, f.read())
+        written.update(files)
+
+    for name in os.listdir(distDir):    # 前回のビルドで作った古いハッシュのファイルを消す
+        if name not in written:
+            os.remove(os.path.join(distDir, name))
+    with open(os.path.join(distDir, "manifest.json"), "w", encoding="UTF-8") as f:
+        json.dump(manifest, f, indent = 4)
+
+    # CSS の link は 1 本にまとめ、残りの参照はハッシュ付き URL に置き換える
+    links                   = iter(range(len(stylesheets)))
+    head                    = stylesheetLink.sub(
+        lambda m: f'<link href="{bundleURL}" rel="stylesheet">\n' if next(links) == 0 else "",
+        styleConfig
+    )
+    head                    = re.sub(
+        r'((?:href|src)=")([^"]+)(")',
+        lambda m: m.group(1) + manifest.get(m.group(2), m.group(2)) + m.group(3),
+        head
+    )
+    with open(os.path.join(templateDir, "styleConfig.dist.html"), "w", encoding="UTF-8") as f:
+        f.write(head)
+
+    original                = sum(os.path.getsize(local_path(url)) for url in stylesheets)
+    print(f"css: {len(stylesheets)} files {original} bytes -> {bundleURL} {len(css)} bytes")
+    for url, hashed in manifest.items():
+        if url in assets:
+            print(f"{url} -> {hashed}")
+
+if __name__ == "__main__":
+    parser                  = argparse.ArgumentParser(description = "CSS / JS をまとめてハッシュ付きのファイル名で書き出す")
+    parser.add_argument("--no-purge", action = "store_true", help = "使われていない Bootstrap のルールも残す")
+    args                    = parser.parse_args()
+
+    build(not args.no_purge)
@@ -1,258 +1,529 @@
 #!/usr/bin/env python3
 
 # pip install pandas_datareader
-from datetime import datetime, date
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # from pandas_datareader import data as pdr
-import requests, json, os, math
-import yfinance as yf
+import json, os, sys, time, copy, queue, threading, subprocess
+# requests / yfinance (pandas) は import が重いので、使う処理の中で import する (キャッシュ命中時は読み込まない)
 
-class GetZabbixData:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
+from common import cacheDir, tokenDir, http_session, read_json, write_json, file_lock, Deadline, PhaseTimer, Histograms, GetZabbixData
+
+weatherURL                              = os.environ.get(
+    "CGITEST_WEATHER_URL",
+    "https://weather.tsukumijima.net/api/forecast/city/"
+)
+
+def parse_cities(text):     # "ID:名前,ID:名前" → {地域 ID : 表示名}。形式の違う項目は stderr に出して飛ばす
+    cities                              = {}
+    for entry in text.split(","):
+        if not entry.strip():           # 末尾のカンマなど
+            continue
+        city, sep, name                 = (part.strip() for part in entry.partition(":"))
+        if not sep or not city.isdigit() or not name:
+            print(f"CGITEST_WEATHER_CITIES: ignored {entry!r} (expected ID:名前)", file = sys.stderr)
+            continue
+        cities[city]                    = name
+    return cities
+
+weatherCities                           = parse_cities(     # 出力順 : 地域 ID → 表示名 ("ID:名前,ID:名前" で変更できる)
+    os.environ.get(
+        "CGITEST_WEATHER_CITIES",
+        "016010:北海道,130010:東京都,230010:愛知県,270000:大阪府,471010:沖縄県"
+    )
+)
+fxSource                                = os.environ.get(   # "yahoo" か "file:<{通貨ペア: レート} の JSON>" (試験用)
+    "CGITEST_FX_SOURCE",
+    "yahoo"
+)
+
+class YahooQuoteSource:     # 複数の通貨ペアを 1 回の yf.download でまとめて取る (日足 5 本だけ)
+    def fetch(self, pairs, timeout = 10):   # → {通貨ペア : 最新値}
+        import yfinance as yf
+        data                            = yf.download(
+            list(pairs),
+            period                      = "5d",
+            interval                    = "1d",
+            progress                    = False,
+            threads                     = False,
+            timeout                     = timeout,
+            group_by                    = "column"      # 列は (Close, 通貨ペア)。multi_level_index は新しい版にしか無いので渡さない
+        )
+        if data is None or data.empty:
+            raise ValueError(f"Empty data from Yahoo: {', '.join(pairs)}")
+        close                           = data["Close"]
+        if close.ndim == 1:             # 古い版は 1 ペアだと列が 1 段になり Series が返る
+            close                       = close.to_frame(list(pairs)[0])
+        quotes                          = {}
+        for pair in pairs:
+            if pair not in close:
+                continue
+            column                      = close[pair].dropna()
+            if not column.empty:
+                quotes[pair]            = float(column.iloc[-1])    # 当日の足の終値は最新のレート
+        return quotes
+
+class FileQuoteSource:      # JSON ファイルのレートを返す (ベンチマークや試験で Yahoo の代わりに使う)
+    def __init__(self, path):
+        self.path                       = path
+
+    def fetch(self, pairs, timeout = 10):
+        with open(self.path, "r", encoding="UTF-8") as f:
+            quotes                      = json.load(f)
+        return {pair : float(quotes[pair]) for pair in pairs if pair in quotes}
+
+def quote_source(name = fxSource):
+    if name.startswith("file:"):
+        return FileQuoteSource(name[len("file:"):])
+    if name == "yahoo":
+        return YahooQuoteSource()
+    raise ValueError(f"unknown FX source: {name}")
+
+class QuoteCache:   # 通貨ペア → (レート, 取得時刻) をプロセス間で共有
     def __init__(
         self,
-        url                             = "http://raspi5.lan:8080/api_jsonrpc.php",
-        token                           = "XXXXXXXXXXXXXXXXXX"
+        path                            = os.path.join(cacheDir, "fx_quotes.json"),
+        ttl                             = 60
     ):
-        self.zabbixURL                  = url
-        self.token                      = token
+        self.path                       = path
+        self.ttl                        = ttl
 
-    def zabbix_request(
-        self,
-        method,
-        params
-    ):
-        payload                         = {
-            "jsonrpc"                   : "2.0",
-            "method"                    : method,
-            "params"                    : params,
-            "auth"                      : self.token,
-            "id"                        : 1
+    def load(self):     # → {通貨ペア : (レート, 経過秒)}
+        now                             = time.time()
+        return {
+            pair : (entry["price"], now - entry["time"]) for pair, entry in read_json(self.path).items()
         }
+
+    def store(self, quotes):
+        entries                         = read_json(self.path)
+        for pair, price in quotes.items():
+            entries[pair]               = {
+                "price"                 : price,
+                "time"                  : time.time()
+            }
+        write_json(self.path, entries)
+
+class RequestWebAPI:
+    def __init__(self, pair='USDJPY=X', source = None, cache = None):
+        self.pair                       = pair
+        self.source                     = quote_source() if source is None else source
+        self.cache                      = QuoteCache() if cache is None else cache
+        self.deadline                   = None
+        self.timer                      = PhaseTimer()
+
+    def get_quotes(self, pairs):    # → {通貨ペア : レート}。TTL を過ぎた分だけまとめて取り直す
+        cached                          = self.cache.load()
+        quotes                          = {
+            pair : cached[pair][0] for pair in pairs if pair in cached and cached[pair][1] < self.cache.ttl
+        }
+        expired                         = [pair for pair in pairs if pair not in quotes]
+        if not expired:
+            return quotes
+
         try:
-            r                           = requests.post(self.zabbixURL, json = payload, timeout=5)
-            r.raise_for_status()
-        except Exception as e: 
-            raise RuntimeError(f"Zabbix API request failed: {e}")
-        
-        res                             = r.json()
-        if "error" in res:
-            raise RuntimeError(
-                f"""Zabbix API error {res['error']['code']}: 
-{res['error']['message']} ({res['error'].get('data')})"""
-            )
+            with self.timer.upstream("fx"):
+                fetched                 = self.source.fetch(
+                    expired,
+                    timeout             = 10 if self.deadline is None else self.deadline.timeout(10)
+                )
+        except Exception as e:
+            print(f"FX quote fetch failed: {e}", file = sys.stderr)
+            fetched                     = {}
+        if fetched:
+            self.cache.store(fetched)
+        quotes.update(fetched)
 
-        return res
-    
-    def get_item_info(
+        for pair in expired:
+            if pair in quotes:
+                continue
+            if pair not in cached:      # 一度も取れていないものは 100 などで埋めずにエラーにする
+                raise ValueError(f"No FX quote for {pair}")
+            print(f"FX quote for {pair} is {cached[pair][1]:.0f}s old", file = sys.stderr)
+            quotes[pair]                = cached[pair][0]
+        return quotes
+
+    def get_doltoyen(self):
+        return self.get_quotes([self.pair])[self.pair]
+
+
+class ForecastCache:    # 地域 ID → 予報 (3 日分)・ETag・有効期限 をプロセス間で共有
+    def __init__(
         self,
-        hostid                          = "10084",
-        key                             = "outside.temp",
-        mode                            = "filter"          # filter : 完全一致 search : 部分一致
+        path                            = os.path.join(cacheDir, "weather_forecasts.json")
     ):
-        if mode not in ("filter", "search"):
-            raise ValueError("mode must be 'filter' or 'search'")
-        item                            = self.zabbix_request(
-            "item.get", 
-            {
-                "hostids"               : hostid,
-                mode                    : {
-                    "key_"              : key
-                },
-                "output"                : [
-                    "itemid", 
-                    "value_type"
-                ]
-            }
-        ).get("result", [])
+        self.path                       = path
 
-        if not item: 
-            raise ValueError(f"Item '{key}' not found on host {hostid}")
-        
-        if len(item) > 1:
-            print(f"Warning: multiple items matched '{key}', using first")
+    def load(self):
+        return read_json(self.path)
 
-        return item[0]["itemid"], item[0]["value_type"]
-    
-    def data_request(   # 最新値を取得
+    def store(self, entries):
+        cached                          = read_json(self.path)  # 他プロセスの更新を取り込んでから書く
+        cached.update(entries)
+        write_json(self.path, cached)
+
+class RequestWeather:
+    publishHours                        = (5, 11, 17)   # 気象庁の天気予報の定時発表 (日本時間)
+    publishDelay                        = 600           # 発表から API に反映されるまでの猶予
+    retryInterval                       = 600           # 発表時刻を過ぎても古い予報だったときに取り直す間隔
+
+    def __init__(
         self,
-        hostid                          = "10084",
-        key                             = "outside.temp"
+        weatherURL                      = weatherURL,
+        cities                          = None,         # 地域 ID の並び (既定は weatherCities)
+        session                         = None,
+        cache                           = None
     ):
-        itemid, value_type              = self.get_item_info(hostid, key)
-
-        value                           = self.zabbix_request(
-            "history.get", 
-            {
-                "history"               : value_type,
-                "itemids"               : itemid,
-                "sortfield"             : "clock",
-                "sortorder"             : "DESC",
-                "limit"                 : 1
-            }
-        ).get("result", [])
+        self.weatherURL                 = weatherURL
+        self.cities                     = list(weatherCities if cities is None else cities)
+        self.cache                      = ForecastCache() if cache is None else cache
+        self.deadline                   = None
+        self.timer                      = PhaseTimer()
+        self.session                    = http_session(
+            "weather",
+            poolSize                    = max(4, len(self.cities))
+        ) if session is None else session
+        self.deadlineSession            = http_session(   # 締め切りがあるときは再試行しない (再試行のたびに残り時間いっぱい待つ)
+            "weather",
+            poolSize                    = max(4, len(self.cities)),
+            retries                     = 0
+        ) if session is None else session
 
-        if not value:
-            raise ValueError(f"No history found for itemid {itemid}")
+    def expires(self, publicTime, now):     # 予報の発表時刻の次の定時発表 (+ 猶予) まで使う
+        tokyo                           = ZoneInfo("Asia/Tokyo")
+        try:
+            published                   = datetime.fromisoformat(publicTime).astimezone(tokyo)
+        except (TypeError, ValueError):
+            return now + self.retryInterval
+        for days in (0, 1):
+            for hour in self.publishHours:
+                slot                    = (published + timedelta(days = days)).replace(hour = hour, minute = 0, second = 0, microsecond = 0)
+                if slot > published:
+                    expires             = slot.timestamp() + self.publishDelay
+                    return expires if expires > now else now + self.retryInterval
 
-        return value[0]["value"]
+    def parse(self, data):  # 今日・明日は詳しい天気、明後日は概況
+        weather                         = []
+        for daten in range(3):
+            try:
+                if daten                == 2:
+                    weather_data        = data["forecasts"][daten]["telop"]
+                else:
+                    weather_data        = data["forecasts"][daten]["detail"]["weather"]
+                weather_data            = weather_data.replace("\u3000","")
+            except Exception as e:
+                print(e, file = sys.stderr)
+                weather_data            = "取得失敗"
+            weather.append(str(weather_data))
+        return weather
 
-class RequestWebAPI:
-    def __init__(self, pair='USDJPY=X'):
-        self.pair = pair
+    def get_city_weather(self, city, entry = None):     # → (3 日分の天気 / 取れず古い予報も無ければ None, キャッシュに書く内容 / 変化なしなら None)
+        now                             = time.time()
+        if entry and now < entry["expires"]:
+            return entry["weather"], None
 
-    def get_doltoyen(self):
+        headers                         = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"]    = entry["etag"]
+        if entry and entry.get("lastModified"):
+            headers["If-Modified-Since"] = entry["lastModified"]
         try:
-            ticker = yf.Ticker(self.pair)
+            timeout                     = 3 if self.deadline is None else self.deadline.timeout(3)
+            session                     = self.session if self.deadline is None else self.deadlineSession
+            with self.timer.upstream("weather"):
+                tenki_data              = session.get(f"{self.weatherURL}{city}", headers = headers, timeout = timeout)
+            if tenki_data.status_code == 304 and entry:
+                return entry["weather"], {**entry, "expires": self.expires(entry["publicTime"], now)}
+            tenki_data.raise_for_status()
+            data                        = json.loads(tenki_data.text)
+        except Exception as e:
+            print(e, file = sys.stderr)     # stdout は CGI の応答なので書かない
+            if entry:                       # 取れなければ古い予報を出す
+                return entry["weather"], None
+            return None, None
 
-            # 1分足の最新データを取得（最も安定）
-            data = ticker.history(period="1d", interval="1m")
+        publicTime                      = data.get("publicTime")
+        weather                         = self.parse(data)
+        return weather, {
+            "weather"                   : weather,
+            "publicTime"                : publicTime,
+            "etag"                      : tenki_data.headers.get("ETag"),
+            "lastModified"              : tenki_data.headers.get("Last-Modified"),
+            "expires"                   : self.expires(publicTime, now)
+        }
 
-            if data.empty:
-                raise ValueError("Empty data from Yahoo")
+    def get_weather(self):  # → {地域 ID : [今日, 明日, 明後日]}
+        cached                          = self.cache.load()
+        expired                         = [
+            city for city in self.cities if city not in cached or time.time() >= cached[city]["expires"]
+        ]
+        results                         = {city : (cached[city]["weather"], None) for city in self.cities if city not in expired}
+        if expired:
+            # 期限切れの都市だけ並列に問い合わせる (条件付きなので多くは 304)
+            with ThreadPoolExecutor(max_workers = len(expired)) as pool:
+                results.update(zip(expired, pool.map(lambda city: self.get_city_weather(city, cached.get(city)), expired)))
+            updates                     = {city : entry for city, (weather, entry) in results.items() if entry is not None}
+            if updates:
+                self.cache.store(updates)
 
-            # 最新の終値（実質リアルタイム）
-            price = data["Close"].iloc[-1]
+        failed                          = [city for city in self.cities if results[city][0] is None]
+        if failed:  # 出せる予報が無い都市があればセクションごと失敗にする (Missing に入り、裏で取り直す)
+            raise RuntimeError(f"weather fetch failed: {', '.join(failed)}")
+        return {city : results[city][0] for city in self.cities}
 
-            if hasattr(price, "item"):
-                price = price.item()
+class SectionCache:     # get_data() の各セクションをプロセス間で共有 (stale-while-revalidate)
+    def __init__(
+        self,
+        path                            = os.path.join(cacheDir, "info_sections.json"),
+        ttl                             = {
+            "fx"                        : 300,
+            "weather"                   : 3600,
+            "zabbix"                    : 30
+        },
+        lockTimeout                     = 60    # 更新プロセスが落ちてもロックを握り続けない
+    ):
+        self.path                       = path
+        self.ttl                        = ttl
+        self.lockTimeout                = lockTimeout
 
-            if not isinstance(price, (float, int)) or math.isnan(price):
-                raise ValueError("Invalid price")
+    def cache_key(self, section, hostid):
+        return f"{section}:{hostid}" if section == "zabbix" else section
 
-            return float(price)
+    def load(self, sections, hostid):   # → {section : (value, 経過秒)}
+        entries                         = read_json(self.path)
+        now                             = time.time()
+        loaded                          = {}
+        for section in sections:
+            entry                       = entries.get(self.cache_key(section, hostid))
+            if entry is not None:
+                loaded[section]         = (entry["value"], max(0.0, now - entry["time"]))
+        return loaded
 
-        except Exception as e:
-            print(e)
-            return 100
+    def store(self, values, hostid):    # 別々のプロセスが別のセクションを同時に書いても、互いの分を消さない
+        with file_lock(self.path):
+            entries                     = read_json(self.path)
+            for section, value in values.items():
+                entries[self.cache_key(section, hostid)] = {
+                    "value"             : value,
+                    "time"              : time.time()
+                }
+            write_json(self.path, entries)
 
+    def is_stale(self, section, age):
+        return age > self.ttl.get(section, 0)
 
+    def lock_path(self, section, hostid):
+        return f"{self.path}.{self.cache_key(section, hostid).replace(':', '-')}.lock"
+
+    def try_lock(self, section, hostid):    # 同じセクションを複数プロセスで同時に取りに行かない
+        path                            = self.lock_path(section, hostid)
+        try:
+            if time.time() - os.path.getmtime(path) > self.lockTimeout:
+                os.remove(path)
+        except OSError:
+            pass
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except OSError:
+            return False
+
+    def unlock(self, section, hostid):
+        try:
+            os.remove(self.lock_path(section, hostid))
+        except OSError:
+            pass
 
-class RequestWeather:
-    def __init__(
-        self,
-        weatherURL                      = "https://weather.tsukumijima.net/api/forecast/city/",
-        cities                          = {
-            "Aichi"                     : {
-                "id"                    : "230010",
-                "weather"               : []
-            }, 
-            "Tokyo"                     : {
-                "id"                    : "130010",
-                "weather"               : []
-            }, 
-            "Osaka"                     : {
-                "id"                    : "270000",
-                "weather"               : []
-            }, 
-            "Okinawa"                   : {
-                "id"                    : "471010",
-                "weather"               : []
-            }, 
-            "Hokkaido"                  : {
-                "id"                    : "016010",
-                "weather"               : []
-            }, 
-        }
-    ):
-        self.weatherURL                 = weatherURL
-        self.cities                     = cities
-    
-    def get_weather(self):
-        for city in self.cities:
-            cityparam                   = self.cities[city]["id"]
-            url                         = f"{self.weatherURL}{cityparam}"
-            try:
-                tenki_data              = requests.get(url, timeout=3)
-                data                    = json.loads(tenki_data.text)
-                self.cities[city]["weather"].clear()
-            except Exception as e:
-                print(e)
-                continue
-            
-            for daten in range(3):
-                try:
-                    if daten            == 2:
-                        weather_data    = data["forecasts"][daten]["telop"]
-                    else:
-                        weather_data    = data["forecasts"][daten]["detail"]["weather"]
-                    weather_data        = weather_data.replace("\u3000","")
-                except Exception as e:
-                    print(e)
-                    weather_data        = "取得失敗"
-                finally:
-                    self.cities[city]["weather"].append(str(weather_data))
-
-        return self.cities
-    
 class JSONDataCreate():
     dirName = os.path.dirname(os.path.abspath(__file__))
+    weatherNames                        = weatherCities     # 出力順 : 地域 ID → 表示名
+    fxNames                             = {     # 出力順 : 通貨ペア → 表示名 (まとめて 1 回で取る)
+        "USDJPY=X"                      : "ドル円"
+    }
+    sections                            = ("fx", "weather", "zabbix")
+    zabbixKeys                          = ("HostName", "CPUTemp", "温度", "湿度")    # zabbix が取れなくても null で出す
+    budget                              = float(os.environ.get("CGITEST_DEADLINE", 3))  # 1 リクエストで上流を待つ秒数の上限
 
-    def __init__(self):
-        self.weather                    = RequestWeather()
+    def __init__(self, cache = None):
+        self.weather                    = RequestWeather(cities = self.weatherNames)
         self.api                        = RequestWebAPI()
-        with open(f"{os.path.dirname(self.dirName)}/TOKEN/zabbix.token", "r", encoding="UTF-8") as token:
+        self.cache                      = SectionCache() if cache is None else cache
+        with open(os.path.join(tokenDir, "zabbix.token"), "r", encoding="UTF-8") as token:
             self.zabbixToken = token.read()
             self.zbxdata                = GetZabbixData(token = self.zabbixToken)
+        self.start_timer()
 
-    def get_data(self, hostid = "10688"):
-        JPYUSD                          = self.api.get_doltoyen()
-        self.cities                     = self.weather.get_weather()
-        hostName                        = self.zbxdata.data_request(hostid = hostid, key = "system.hostname")
-        cpuTemp                         = float(self.zbxdata.data_request(hostid = hostid, key = "cpu.temp"))
-        self.tmp                        = float(self.zbxdata.data_request(hostid = "10084", key = "outside.temp"))
-        self.rhm                        = float(self.zbxdata.data_request(hostid = "10084", key = "outside.hum"))
-        
-        data                            = { 
-            "HostName"                  : hostName,
-            "CPUTemp"                   : cpuTemp,
+    def start_timer(self):  # 1 リクエスト (または 1 回の更新) ごとに測り直す
+        self.timer                      = PhaseTimer()
+        self.zbxdata.timer = self.weather.timer = self.api.timer = self.timer
+        return self.timer
+
+    def for_request(self):  # 常駐プロセス用 : セッション・キャッシュは共有し、締め切りと PhaseTimer を持つ上流クライアントだけ複製する
+        request                         = copy.copy(self)
+        request.zbxdata                 = copy.copy(self.zbxdata)
+        request.weather                 = copy.copy(self.weather)
+        request.api                     = copy.copy(self.api)
+        request.start_timer()
+        return request
+
+    def fetch_section(self, section, hostid):
+        if section                      == "fx":
+            quotes                      = self.api.get_quotes(list(self.fxNames))
+            return {
+                name                    : str(quotes[pair]) for pair, name in self.fxNames.items()
+            }
+        if section                      == "weather":
+            self.cities                 = self.weather.get_weather()
+            return {
+                name                    : {
+                    "今日"              : self.cities[city][0],
+                    "明日"              : self.cities[city][1],
+                    "明後日"            : self.cities[city][2],
+                } for city, name in self.weatherNames.items()
+            }
+
+        values                          = self.zbxdata.data_request_many([
+            (hostid, "system.hostname"),
+            (hostid, "cpu.temp"),
+            ("10084", "outside.temp"),
+            ("10084", "outside.hum")
+        ])
+        self.tmp                        = float(values[("10084", "outside.temp")])
+        self.rhm                        = float(values[("10084", "outside.hum")])
+        return {
+            "HostName"                  : values[(hostid, "system.hostname")],
+            "CPUTemp"                   : float(values[(hostid, "cpu.temp")]),
             "温度"                      : f"{self.tmp:4.2f}℃",
-            "湿度"                      : f"{self.rhm:4.2f}%",
-            "為替"                      :{
-                "ドル円"                : str(JPYUSD)
-            },
-            "天気"                      :{
-                "北海道"                :{
-                    "今日"              : self.cities["Hokkaido"]["weather"][0],
-                    "明日"              : self.cities["Hokkaido"]["weather"][1],
-                    "明後日"            : self.cities["Hokkaido"]["weather"][2],
-                },
-                "東京都"                :{
-                    "今日"              : self.cities["Tokyo"]["weather"][0],
-                    "明日"              : self.cities["Tokyo"]["weather"][1],
-                    "明後日"            : self.cities["Tokyo"]["weather"][2],
-                },
-                "愛知県"                :{
-                    "今日"              : self.cities["Aichi"]["weather"][0],
-                    "明日"              : self.cities["Aichi"]["weather"][1],
-                    "明後日"            : self.cities["Aichi"]["weather"][2],
-                },
-                "大阪府"                :{
-                    "今日"              : self.cities["Osaka"]["weather"][0],
-                    "明日"              : self.cities["Osaka"]["weather"][1],
-                    "明後日"            : self.cities["Osaka"]["weather"][2],
-                },
-                "沖縄県"                :{
-                    "今日"              : self.cities["Okinawa"]["weather"][0],
-                    "明日"              : self.cities["Okinawa"]["weather"][1],
-                    "明後日"            : self.cities["Okinawa"]["weather"][2],
-                }
-            },
-            "UpdateTime"                : datetime.strftime(datetime.now(ZoneInfo("Asia/Tokyo")), '%Y/%m/%d %H:%M:%S'),
-            
+            "湿度"                      : f"{self.rhm:4.2f}%"
         }
 
+    def fetch_timed(self, section, hostid):
+        with self.timer.phase(section):
+            return self.fetch_section(section, hostid)
+
+    def fetch_sections(self, sections, hostid):     # 並列に取得し、終わった順に (section, value) を返す
+        if not sections:
+            return
+        with ThreadPoolExecutor(max_workers = len(sections)) as pool:
+            futures                     = {
+                pool.submit(self.fetch_timed, section, hostid) : section for section in sections
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def refresh(self, sections, hostid = "10688"):  # バックグラウンド更新プロセスの本体
+        self.start_timer()
+        fetched                         = {}
+        try:                            # 一部が失敗しても取れた分は保存する (失敗した分は前の値が残る)
+            for section, value in self.fetch_sections(sections, hostid):
+                fetched[section]        = value
+        finally:
+            if fetched:
+                self.cache.store(fetched, hostid)
+            for section in sections:
+                self.cache.unlock(section, hostid)
+            Histograms().record("info", "refresh", self.timer)     # 上流の遅さはほとんどこちらに出る
+
+    def refresh_background(self, sections, hostid):
+        # CGI は 1 リクエスト 1 プロセスなので、応答を返した後も残る別プロセスで更新する
+        sections                        = [s for s in sections if self.cache.try_lock(s, hostid)]
+        if not sections:
+            return
+        env                             = os.environ.copy()
+        env["CGITEST_REFRESH"]          = ",".join(sections)
+        env["CGITEST_REFRESH_HOST"]     = hostid
+        try:
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__)],
+                env                     = env,
+                stdin                   = subprocess.DEVNULL,
+                stdout                  = subprocess.DEVNULL,
+                stderr                  = subprocess.DEVNULL,
+                start_new_session       = True
+            )
+        except OSError:
+            for section in sections:
+                self.cache.unlock(section, hostid)
+
+    def fetch_until(self, sections, hostid, deadline):  # 締め切りまでに取れたセクションだけ返す (失敗・間に合わなかった分は入らない)
+        if not sections:
+            return {}
+        self.zbxdata.deadline = self.weather.deadline = self.api.deadline = deadline
+        results                         = queue.Queue()
+
+        def run(section):
+            try:
+                results.put((section, self.fetch_timed(section, hostid), None))
+            except Exception as e:
+                results.put((section, None, e))
+
+        for section in sections:        # 間に合わなかった取得は daemon スレッドに置き去りにし、プロセスの終了を待たせない
+            threading.Thread(target = run, args = (section,), daemon = True).start()
+        fetched                         = {}
+        for _ in sections:
+            try:
+                section, value, error   = results.get(timeout = deadline.remaining())
+            except queue.Empty:
+                break
+            if error is None:
+                fetched[section]        = value
+            else:
+                print(f"{section}: {error}", file = sys.stderr)
+        return fetched
+
+    def get_data(self, hostid = "10688", useCache = True, budget = None):
+        deadline                        = Deadline(self.budget if budget is None else budget)
+        self.start_timer()
+        with self.timer.phase("cache"):
+            loaded                      = self.cache.load(self.sections, hostid) if useCache else {}
+        missing                         = [s for s in self.sections if s not in loaded]
+        stale                           = [s for s in loaded if self.cache.is_stale(s, loaded[s][1])]
+
+        # キャッシュに無いセクションだけはその場で取得する (締め切りを過ぎたら取れた分だけで返す)
+        fetched                         = self.fetch_until(missing, hostid, deadline)
+        if fetched and useCache:
+            self.cache.store(fetched, hostid)
+        unfinished                      = [s for s in missing if s not in fetched]
+        if useCache and (stale or unfinished):
+            self.refresh_background(stale + unfinished, hostid)    # 間に合わなかった分は締め切り無しで取ってキャッシュに入れる
+
+        values                          = {s : loaded[s][0] for s in loaded}
+        values.update(fetched)
+        ages                            = {s : round(loaded[s][1], 1) for s in loaded}
+        ages.update({s : 0.0 for s in fetched})
+
+        data                            = { 
+            **values.get("zabbix", dict.fromkeys(self.zabbixKeys)),
+            "為替"                      : values.get("fx"),
+            "天気"                      : values.get("weather"),
+            "UpdateTime"                : datetime.strftime(datetime.now(ZoneInfo("Asia/Tokyo")), '%Y/%m/%d %H:%M:%S'),
+            "CacheAge"                  : {s : ages.get(s) for s in self.sections},     # 各セクションの取得からの秒数
+            "Missing"                   : unfinished    # 締め切りまでに取れなかったセクション (値は null)
+        }
+        Histograms().record("info", "get_data", self.timer)
         return data
     
 
 
 if __name__ == "__main__": 
+    if "CGITEST_REFRESH" in os.environ:
+        JSONDataCreate().refresh(
+            os.environ["CGITEST_REFRESH"].split(","),
+            os.environ.get("CGITEST_REFRESH_HOST", "10688")
+        )
+        sys.exit()
+
     data = JSONDataCreate()
-    print("""Content-Type: application/json; charset=UTF-8
+    body = json.dumps(
+        data.get_data("10688"),
+        ensure_ascii = False,
+        indent = 4
+    )
+    print(f"""Content-Type: application/json; charset=UTF-8
+Server-Timing: {data.timer.header()}
 """)
-    print(
-        json.dumps(
-            data.get_data("10688"),
-            ensure_ascii = False,
-            indent = 4
-        )
-    )
\ No newline at end of file
+    print(body)
+    sys.stdout.flush()      # 応答はここで閉じる (上流の取得がまだ残っていてもサーバを待たせない)
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
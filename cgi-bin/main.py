@@ -1,149 +1,609 @@
 #!/usr/bin/env python3
 
-import pycgi, pycgitb
-import os, platform, subprocess, requests, math, psutil, markdown
+import pycgitb
+import os, sys, platform, subprocess, math, json, time, threading, mmap, struct, html, string, functools, hashlib, gzip, heapq, urllib.parse, contextlib
+from collections import deque
+# requests / psutil は import が重いので、使う処理の中で import する (CGI の起動時間短縮)
 
 # sudo apt install python3-psutil
-# pip install libcgipy markdown
+# pip install libcgipy
 # sudo visudo
 # Defaults:www-data env_keep += "XDG_RUNTIME_DIR DBUS_SESSION_BUS_ADDRESS"
 # www-data ALL=(ALL) NOPASSWD: /sbin/shutdown
 # www-data ALL=(ALL) NOPASSWD: /usr/bin/systemctl --user
 
-class GetZabbixData:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
+from common import cacheDir, tokenDir, read_json, write_json, PhaseTimer, Histograms, GetZabbixData
+
+templateDir                 = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "template",
+    "html"
+)
+distDir                     = os.path.join(     # build_static.py の出力先
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "view",
+    "dist"
+)
+
+class ListeningPorts:     # PID → LISTEN 中のポート。ソケット表が変わった分だけ持ち主の PID を引き直す
+    procTables              = ("/proc/net/tcp", "/proc/net/tcp6")
+
     def __init__(
         self,
-        url                 = "http://raspi5.lan:8080/api_jsonrpc.php",
-        token               = "XXXXXXXXXXXXXXXXXX"
+        path                = os.path.join(cacheDir, "listening_ports.json"),
+        interval            = 10.0          # この秒数以内ならソケット表も読まずに共有ファイルの結果を返す
     ):
-        self.zabbixURL      = url
-        self.token          = token
+        self.path           = path
+        self.interval       = interval
+
+    def listening_sockets(self):    # → {inode : port} (状態 0A = LISTEN の行だけ)
+        sockets             = {}
+        for table in self.procTables:
+            try:
+                f           = open(table, "r")
+            except OSError:
+                continue
+            with f:
+                next(f, None)
+                for line in f:
+                    fields  = line.split()
+                    if len(fields) > 9 and fields[3] == "0A":
+                        sockets[fields[9]] = int(fields[1].rsplit(":", 1)[1], 16)
+        return sockets
+
+    def find_owners(self, inodes):  # 新しく現れたソケットの持ち主だけを /proc/<pid>/fd から探す
+        wanted              = {f"socket:[{inode}]" : inode for inode in inodes}
+        owners              = {}
+        for pid in os.listdir("/proc"):
+            if not wanted:
+                break
+            if not pid.isdigit():
+                continue
+            fdDir           = f"/proc/{pid}/fd"
+            try:
+                fds         = os.listdir(fdDir)
+            except OSError:
+                continue
+            for fd in fds:
+                try:
+                    link    = os.readlink(f"{fdDir}/{fd}")
+                except OSError:
+                    continue
+                if link in wanted:
+                    owners[wanted.pop(link)] = int(pid)
+        return owners
+
+    def scan_psutil(self):          # /proc/net が無い OS では従来どおり全接続を見る
+        import psutil
+        ports               = {}
+        for conn in psutil.net_connections(kind='inet'):
+            if conn.pid and conn.laddr and conn.status == psutil.CONN_LISTEN:
+                ports.setdefault(str(conn.pid), set()).add(conn.laddr.port)
+        return {}, ports
+
+    def scan_proc(self, known):
+        sockets             = self.listening_sockets()
+        entries             = {inode : known[inode] for inode in sockets if inode in known}
+        added               = [inode for inode in sockets if inode not in known]
+        if added:
+            owners          = self.find_owners(added)
+            for inode in added:
+                if inode in owners:     # 持ち主が見えないソケットは覚えず、次回また探す
+                    entries[inode] = [owners[inode], sockets[inode]]
 
-    def zabbix_request(
+        ports               = {}
+        for pid, port in entries.values():
+            ports.setdefault(str(pid), set()).add(port)
+        return entries, ports
+
+    def refresh(self, state = {}):
+        if os.path.exists(self.procTables[0]):
+            entries, ports  = self.scan_proc(state.get("sockets", {}))
+        else:
+            entries, ports  = self.scan_psutil()
+        state               = {
+            "time"          : time.time(),
+            "sockets"       : entries,      # inode → [pid, port]
+            "ports"         : {pid : sorted(p) for pid, p in ports.items()}
+        }
+        write_json(self.path, state)
+        return state
+
+    def lookup(self):               # → {pid : [port, ...]}
+        state               = read_json(self.path)
+        if time.time() - state.get("time", 0) >= self.interval:
+            state           = self.refresh(state)
+        return {int(pid) : ports for pid, ports in state.get("ports", {}).items()}
+
+class ProcessSnapshot:    # サンプラーが書き、WebCGI が読むプロセス一覧 (mmap した固定長レコード)
+    header                  = struct.Struct("<4sIQddI")     # magic, version, seq, 更新時刻, 間隔, 件数
+    record                  = struct.Struct("<iff64s")      # pid, CPU%, RSS MB, 名前 (UTF-8)
+    magic                   = b"PSNP"
+    version                 = 1
+
+    def __init__(
         self,
-        method,
-        params
+        path                = os.path.join(cacheDir, "processes.snapshot"),
+        capacity            = 4096
     ):
-        payload             = {
-            "jsonrpc"       : "2.0",
-            "method"        : method,
-            "params"        : params,
-            "auth"          : self.token,
-            "id"            : 1
-        }
+        self.path           = path
+        self.capacity       = capacity
+        self.size           = self.header.size + capacity * self.record.size
+        self.mm             = None
+        self.seq            = None          # 最後に read() で読めた版 (ETag に使う)
+
+    def open_writer(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        fd                  = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
         try:
-            r               = requests.post(self.zabbixURL, json = payload, timeout=5)
-            r.raise_for_status()
-        except Exception as e: 
-            raise RuntimeError(f"Zabbix API request failed: {e}")
-        
-        res                 = r.json()
-        if "error" in res:
-            raise RuntimeError(
-                f"""Zabbix API error {res['error']['code']}: 
-{res['error']['message']} ({res['error'].get('data')})"""
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, self.size)
+            self.mm         = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+
+    def write(self, rows, interval = 0.0):    # rows : [(pid, 名前, CPU%, RSS MB or None)]
+        if self.mm is None:
+            self.open_writer()
+        rows                = sorted(rows, key = lambda row: -(row[3] or 0))[:self.capacity]
+        seq                 = self.header.unpack_from(self.mm, 0)[2] if self.mm[:4] == self.magic else 0
+        seq                 += 1 if seq % 2 == 0 else 2
+        # seqlock : 奇数の間は書き込み中。読み手は前後で seq が同じ偶数であることを確認する
+        self.header.pack_into(self.mm, 0, self.magic, self.version, seq, time.time(), interval, 0)
+        offset              = self.header.size
+        for pid, name, cpu, mem in rows:
+            self.record.pack_into(
+                self.mm, offset, pid, cpu, -1.0 if mem is None else mem,
+                name.encode("UTF-8")[:self.record.size - 12]
             )
+            offset          += self.record.size
+        self.header.pack_into(self.mm, 0, self.magic, self.version, seq + 1, time.time(), interval, len(rows))
 
-        return res
-    
-    def get_item_info(
-        self,
-        hostid              = "10084",
-        key                 = "outside.temp",
-        mode                = "filter"          # filter : 完全一致 search : 部分一致
-    ):
-        if mode not in ("filter", "search"):
-            raise ValueError("mode must be 'filter' or 'search'")
-        item                = self.zabbix_request(
-            "item.get", 
-            {
-                "hostids"   : hostid,
-                mode        : {
-                    "key_"  : key
-                },
-                "output"    : [
-                    "itemid", 
-                    "value_type"
-                ]
-            }
-        ).get("result", [])
-
-        if not item: 
-            raise ValueError(f"Item '{key}' not found on host {hostid}")
-        
-        if len(item) > 1:
-            print(f"Warning: multiple items matched '{key}', using first")
+    def read_header(self, mm):
+        magic, version, seq, updated, interval, count = self.header.unpack_from(mm, 0)
+        if magic != self.magic or version != self.version:
+            return None
+        return seq, updated, interval, count
 
-        return item[0]["itemid"], item[0]["value_type"]
-    
-    def data_request(   # 最新値を取得
+    def read(self, maxAge = None):  # 新しいスナップショットが無ければ None
+        try:
+            with open(self.path, "rb") as f:
+                mm          = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        with mm:
+            for _ in range(5):
+                header      = self.read_header(mm)
+                if header is None:
+                    return None
+                seq, updated, interval, count = header
+                if maxAge is None:
+                    maxAge  = max(5.0, interval * 3)
+                if time.time() - updated > maxAge:
+                    return None
+                if seq % 2:
+                    time.sleep(0.001)
+                    continue
+                data        = mm[self.header.size:self.header.size + count * self.record.size]
+                if self.read_header(mm)[0] != seq:
+                    continue
+                rows        = []
+                for pid, cpu, mem, name in self.record.iter_unpack(data):
+                    rows.append((pid, name.rstrip(b"\0").decode("UTF-8", "ignore"), cpu, None if mem < 0 else mem))
+                self.seq    = seq
+                return rows
+        return None
+
+class ProcessSampler:     # 一定間隔でプロセスを巡回し、CPU / RSS の移動平均をスナップショットに書く
+    def __init__(
         self,
-        hostid              = "10084",
-        key                 = "outside.temp"
+        snapshot            = None,
+        interval            = 2.0,
+        window              = 5,            # 移動平均に使うサンプル数
+        ports               = None
     ):
-        itemid, value_type  = self.get_item_info(hostid, key)
+        self.snapshot       = ProcessSnapshot() if snapshot is None else snapshot
+        self.ports          = ListeningPorts() if ports is None else ports
+        self.interval       = interval
+        self.window         = window
+        self.history        = {}            # pid → (CPU の deque, RSS の deque)
+        self.series         = {}            # プロセス名 → TimeSeries (RSS の履歴)
+        self.seriesTop      = 16            # RSS の履歴を残すのは名前ごとの合計が大きい順にこの数まで
+        self.prunedAt       = 0.0           # 最後に古い RSS の履歴を消した時刻
+
+    def sample(self):
+        import psutil
+        cpuCount            = psutil.cpu_count() or 1
+        rows                = []
+        seen                = set()
+        for p in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_info']):
+            info            = p.info
+            pid             = info['pid']
+            seen.add(pid)
+            cpus, mems      = self.history.setdefault(pid, (deque(maxlen = self.window), deque(maxlen = self.window)))
+            if info.get('cpu_percent') is not None:
+                cpus.append(info['cpu_percent'] / cpuCount)
+            if info.get('memory_info'):
+                mems.append(info['memory_info'].rss / (1024 * 1024))
+            rows.append((
+                pid,
+                info['name'] or "",
+                sum(cpus) / len(cpus) if cpus else -1,
+                sum(mems) / len(mems) if mems else None
+            ))
 
-        value = self.zabbix_request(
-            "history.get", 
-            {
-                "history"   : value_type,
-                "itemids"   : itemid,
-                "sortfield" : "clock",
-                "sortorder" : "DESC",
-                "limit"     : 1
-            }
-        ).get("result", [])
+        for pid in set(self.history) - seen:    # 終了したプロセスの履歴は捨てる
+            del self.history[pid]
 
-        if not value:
-            raise ValueError(f"No history found for itemid {itemid}")
+        self.snapshot.write(rows, self.interval)
+        self.ports.lookup()                     # ポートのインデックスも期限切れなら更新しておく
+        self.record_rss(rows)
+        return rows
 
-        return value[0]["value"]
+    def record_rss(self, rows):     # 同じ名前のプロセスの RSS を合計して履歴に足す
+        totals              = {}
+        for pid, name, cpu, mem in rows:
+            if mem is not None:
+                totals[name] = totals.get(name, 0.0) + mem
+        top                 = dict(heapq.nlargest(self.seriesTop, totals.items(), key = lambda item: item[1]))
+        for name in set(self.series) - set(top):    # 上位から外れた名前のファイルは閉じておく (履歴は残る)
+            self.series.pop(name).close()
+        for name, mem in top.items():
+            if name not in self.series:
+                self.series[name] = TimeSeries(f"rss.{name}")
+            self.series[name].append(mem)
+        if time.time() - self.prunedAt > 3600:  # 最長の表示期間 (7 日) より長く上位に入らなかった名前の履歴は消す
+            TimeSeries.prune("rss.", TimeSeries.spans["7d"])
+            self.prunedAt   = time.time()
 
+    def run(self):
+        while True:
+            started         = time.monotonic()
+            self.sample()
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
 
+class TimeSeries:   # 1 系列分のリングバッファ。粒度の違う段ごとに (時刻, 平均, 件数) の double 3 つを固定長で並べて mmap する
+    header                  = struct.Struct("<4sIQ")        # magic, version, seq
+    tier                    = struct.Struct("<II")          # 次に書く位置, 件数
+    magic                   = b"TSRB"
+    version                 = 1
+    tiers                   = (                             # (1 点の幅 秒, 点数) : 1 時間 / 24 時間 / 7 日
+        (60, 60),
+        (600, 144),
+        (3600, 168)
+    )
+    spans                   = {"1h": 3600, "24h": 86400, "7d": 604800}
 
+    def __init__(self, name, baseDir = os.path.join(cacheDir, "series")):
+        self.name           = name
+        self.path           = os.path.join(baseDir, self.file_name(name))
+        self.dataOffset     = self.header.size + len(self.tiers) * self.tier.size
+        self.size           = self.dataOffset + sum(count for width, count in self.tiers) * 3 * 8
+        self.mm             = None
+        self.fd             = None
+
+    @staticmethod
+    def file_name(name):    # 使えない文字は _ にし、その場合は元の名前のハッシュを足して別の名前と重ならないようにする
+        safe                = "".join(c if c.isalnum() or c in "._-" else "_" for c in name)
+        if safe != name:
+            safe            += "-" + hashlib.blake2b(name.encode("UTF-8"), digest_size = 4).hexdigest()
+        return safe + ".tsr"
+
+    @classmethod
+    def prune(cls, prefix, maxAge, baseDir = os.path.join(cacheDir, "series")):   # prefix で始まる系列のうち maxAge 秒以上書かれていないファイルを消す
+        limit               = time.time() - maxAge
+        try:
+            names           = os.listdir(baseDir)
+        except OSError:
+            return
+        for name in names:
+            if not (name.startswith(prefix) and name.endswith(".tsr")):
+                continue
+            try:
+                if os.path.getmtime(os.path.join(baseDir, name)) < limit:
+                    os.remove(os.path.join(baseDir, name))
+            except OSError:
+                pass
+
+    def open_writer(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        self.fd             = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self.locked():
+            if os.fstat(self.fd).st_size != self.size:
+                os.ftruncate(self.fd, self.size)
+            self.mm         = mmap.mmap(self.fd, self.size)
+            if self.header.unpack_from(self.mm, 0)[:2] != (self.magic, self.version):
+                self.mm[:]  = bytes(self.size)      # 形式が違えば作り直す
+                self.header.pack_into(self.mm, 0, self.magic, self.version, 0)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            os.close(self.fd)
+            self.mm, self.fd = None, None
+
+    @contextlib.contextmanager
+    def locked(self):       # 書き手は複数 (CGI / app.py / sampler.py) なのでファイルロックで順番にする
+        try:
+            import fcntl
+        except ImportError:
+            fcntl           = None
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def append(self, value, when = None):  # 各段の最新の枠に平均として足し込む (枠が変われば次の位置へ)
+        if self.mm is None:
+            self.open_writer()
+        when                = time.time() if when is None else when
+        with self.locked():
+            magic, version, seq = self.header.unpack_from(self.mm, 0)
+            self.header.pack_into(self.mm, 0, magic, version, seq + 1)  # seqlock : 奇数の間は書き込み中
+            data            = memoryview(self.mm)[self.dataOffset:].cast("d")
+            try:
+                base        = 0
+                for index, (width, capacity) in enumerate(self.tiers):
+                    offset  = self.header.size + index * self.tier.size
+                    head, count = self.tier.unpack_from(self.mm, offset)
+                    bucket  = when - when % width
+                    last    = base + ((head - 1) % capacity) * 3
+                    if count and data[last] == bucket:
+                        n   = data[last + 2]
+                        data[last + 1] = (data[last + 1] * n + value) / (n + 1)
+                        data[last + 2] = n + 1
+                    elif not count or bucket > data[last]:
+                        slot = base + head * 3
+                        data[slot], data[slot + 1], data[slot + 2] = bucket, value, 1
+                        self.tier.pack_into(self.mm, offset, (head + 1) % capacity, min(count + 1, capacity))
+                    base    += capacity * 3
+            finally:
+                data.release()
+                self.header.pack_into(self.mm, 0, magic, version, seq + 2)
+        if os.utime in os.supports_fd:  # mmap への書き込みでは mtime が進まないことがあるので、prune() 用に最終更新を残す
+            os.utime(self.fd)
+
+    def read(self, span = "24h", now = None):  # → [(時刻, 平均)] 古い順。span に足りる一番細かい段から読む
+        seconds             = self.spans.get(span, span) if isinstance(span, str) else span
+        now                 = time.time() if now is None else now
+        index               = next((i for i, (width, count) in enumerate(self.tiers) if width * count >= seconds), len(self.tiers) - 1)
+        width, capacity     = self.tiers[index]
+        base                = sum(count for width, count in self.tiers[:index]) * 3
+        try:
+            with open(self.path, "rb") as f:
+                mm          = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return []
+        with mm:
+            if len(mm) != self.size:
+                return []
+            for _ in range(5):
+                magic, version, seq = self.header.unpack_from(mm, 0)
+                if (magic, version) != (self.magic, self.version):
+                    return []
+                if seq % 2:
+                    time.sleep(0.001)
+                    continue
+                head, count = self.tier.unpack_from(mm, self.header.size + index * self.tier.size)
+                data        = memoryview(mm)[self.dataOffset:].cast("d")
+                try:
+                    records = data[base:base + capacity * 3].tolist()
+                finally:
+                    data.release()
+                if self.header.unpack_from(mm, 0)[2] != seq:
+                    continue
+                start       = (head - count) % capacity
+                points      = []
+                for i in range(count):
+                    slot    = ((start + i) % capacity) * 3
+                    if records[slot] >= now - seconds:
+                        points.append((records[slot], records[slot + 1]))
+                return points
+        return []
+
+class Template:     # str.format 形式のテンプレートを事前に分割しておき、join だけで描画する
+    def __init__(self, text):
+        self.segments       = []            # (固定文字列, 置換フィールド名, 書式指定)
+        for literal, field, spec, conversion in string.Formatter().parse(text):
+            self.segments.append((literal, field, spec or ""))   # {{ }} はここで { } に戻る
+
+    def render(self, **values):
+        parts               = []
+        for literal, field, spec in self.segments:
+            parts.append(literal)
+            if field is not None:
+                value       = values[field]
+                parts.append(format(value, spec) if spec else str(value))
+        return "".join(parts)
+
+class TemplateCache:    # テンプレートは 1 度だけ読み込み、更新時刻が変わったときだけ読み直す
+    entries                 = {}            # パス → (mtime, 内容) をプロセス全体で共有
+    lock                    = threading.Lock()
+
+    def __init__(self, baseDir = templateDir):
+        self.baseDir        = baseDir
+
+    def load(self, name, compiled = True):  # compiled = False なら文字列のまま返す
+        path                = os.path.join(self.baseDir, name)
+        mtime               = os.stat(path).st_mtime_ns
+        key                 = (path, compiled)
+        entry               = self.entries.get(key)
+        if entry is None or entry[0] != mtime:
+            with open(path, "r", encoding="UTF-8") as f:
+                text        = f.read()
+            entry           = (mtime, Template(text) if compiled else text)
+            with self.lock:
+                self.entries[key] = entry
+        return entry[1]
+
+class Markup(str):  # table_create でエスケープしないセル (組み立て済みの HTML)
+    pass
+
+class LiveStates:       # ライブ更新で返した版ごとの各部分のハッシュ (差分の基準) を直近 keep 件だけ共有する
+    def __init__(self, path = os.path.join(cacheDir, "live_states.json"), keep = 8):
+        self.path           = path
+        self.keep           = keep
+
+    def get(self, version):
+        entry               = read_json(self.path).get(version)
+        return entry["state"] if entry else None
+
+    def put(self, version, state):
+        states              = read_json(self.path)
+        if version in states:
+            return
+        states[version]     = {"time": time.time(), "state": state}
+        latest              = sorted(states, key = lambda v: states[v]["time"])[-self.keep:]
+        write_json(self.path, {v: states[v] for v in latest})
+
+class StaticAssets:     # build_static.py が書き出した manifest.json (元 URL → ハッシュ付き URL) を引く
+    entries                 = {}
+    lock                    = threading.Lock()
+
+    def __init__(self, path = os.path.join(distDir, "manifest.json")):
+        self.path           = path
+
+    def manifest(self):     # ビルドしていなければ空 (元の URL をそのまま使う)
+        try:
+            mtime           = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return {}
+        entry               = self.entries.get(self.path)
+        if entry is None or entry[0] != mtime:
+            entry           = (mtime, read_json(self.path))
+            with self.lock:
+                self.entries[self.path] = entry
+        return entry[1]
+
+    def url(self, path):
+        return self.manifest().get(path, path)
+
+    def head(self):         # ビルド済みならハッシュ付き URL に書き換えた styleConfig を使う
+        if self.manifest() and os.path.isfile(os.path.join(templateDir, "styleConfig.dist.html")):
+            return "styleConfig.dist.html"
+        return "styleConfig.html"
+
+def svg_number(value):      # 座標は小数 2 桁で十分 (13.000000000000002 → 13)
+    text                    = f"{value:.2f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+@functools.lru_cache(maxsize = 64)
+def gauge_frame(radius, margin, scales, bgColor):   # 値に依存しない部分 (半円・目盛り) は設定ごとに 1 回だけ作る
+    cx                      = radius + margin
+    cy                      = radius + margin
+    arc                     = f"M{margin},{svg_number(cy)}A{radius},{radius} 0 0,1 {svg_number(2 * radius + margin)},{svg_number(cy)}"
+
+    ticks                   = []
+    for s in scales:
+        p                   = (s - scales[0]) / (scales[-1] - scales[0])
+        p                   = max(0, min(1, p))
+        angle               = math.pi * (1 - p)
+        r1                  = radius * 0.85     # 内側
+        r2                  = radius * 1.00     # 外側
+        ticks.append(
+            f'<line x1="{svg_number(cx + r1 * math.cos(angle))}" y1="{svg_number(cy - r1 * math.sin(angle))}" '
+            f'x2="{svg_number(cx + r2 * math.cos(angle))}" y2="{svg_number(cy - r2 * math.sin(angle))}" stroke="#666" stroke-width="0.5"/>'
+        )
+
+    return {
+        "viewBox"           : f"0 0 {svg_number(2 * radius + margin * 2)} {svg_number(radius + margin * 2)}",
+        "background"        : f'<path d="{arc}" fill="none" stroke="{bgColor}" stroke-width="{svg_number(margin / 2)}"/>',
+        "arc"               : arc,
+        "ticks"             : "".join(ticks),
+        "center"            : f'<circle cx="{svg_number(cx)}" cy="{svg_number(cy)}" r="{svg_number(radius * 0.08)}" fill="#000"/>',
+        "cx"                : cx,
+        "cy"                : cy,
+        "maxLength"         : math.pi * radius
+    }
 
 class WebCGI():
     dirName = os.path.dirname(os.path.abspath(__file__))
+    resources                   = {}                    # プロセス内で 1 度だけ用意するもの (常駐時は使い回す)
+    resourceLock                = threading.Lock()
+    liveInterval                = 5                     # ライブ更新の間隔 (秒)
+    processDefaults             = {                     # 指定が無いときは従来どおり全件をサンプラー (無ければ psutil) の順に出す
+        "sort"                  : None,
+        "top"                   : None,
+        "page"                  : 1,
+        "filter"                : ""
+    }
+    processSorts                = {                     # sort → (キー, 大きい順か)
+        "cpu"                   : (lambda p: p[2], True),
+        "rss"                   : (lambda p: -1 if p[3] is None else p[3], True),
+        "pid"                   : (lambda p: p[0], False),
+        "name"                  : (lambda p: p[1].lower(), False)
+    }
 
     def __init__(self, lang = "ja", zabbix = True):
+        self.timer                  = PhaseTimer()
+        self.snapshot               = ProcessSnapshot()
+        self.processes              = self.snapshot.read()
+        self.templates              = TemplateCache()
+        self.template               = self.templates.load("index.html")
+        self.assets                 = StaticAssets()
+        if zabbix:
+            self.zabbixToken        = self.resource("zabbixToken", self.load_zabbix_token)
+        else:
+            self.zabbixToken        = None
+
+        self.lang                   = lang
+        self.log                    = self.resource("log", pycgitb.enable)
+
+    def resource(self, name, factory):
+        with self.resourceLock:
+            if name not in self.resources:
+                self.resources[name] = factory()
+            return self.resources[name]
+
+    def prime_processes(self):  # プロセス表を出すときだけ、Zabbix を待つ前に CPU% の基準点を作る (サンプラーが動いていれば不要)
+        if self.processes is None:
+            self.resource("cpuPrimed", self.prime_cpu_percent)
+
+    def prime_cpu_percent(self):    # cpu_percent(None) は前回呼び出しからの差分なので基準点を作る
+        import psutil
         for p in psutil.process_iter():
             try:
                 p.cpu_percent(None)
             except:
                 pass
-        with open(f"{os.path.dirname(self.dirName)}/template/html/index.html", "r", encoding="UTF-8") as index:
-            self.template = index.read()
-        if zabbix:
-            with open(f"{os.path.dirname(self.dirName)}/TOKEN/zabbix.token", "r", encoding="UTF-8") as token:
-                self.zabbixToken = token.read()
-        else:
-            self.zabbixToken = None
+        return True
 
-        self.lang                   = lang
-        self.log                    = pycgitb.enable()
-        self.md                     = markdown.Markdown(extensions=["extra", "tables", "attr_list"])
-    
-    def page_index(self, title = "Raspberry Pi 4B WebUI"): 
-        with open(f"{os.path.dirname(self.dirName)}/template/html/styleConfig.html", "r", encoding="UTF-8") as html:
-            head = html.read()
-        with open(f"{os.path.dirname(self.dirName)}/template/html/body.html", "r", encoding="UTF-8") as html:
-            body = html.read()
-        
+    def load_zabbix_token(self):
+        with open(os.path.join(tokenDir, "zabbix.token"), "r", encoding="UTF-8") as token:
+            return token.read()
+
+    def process_rows(self):     # → [(pid, 名前, CPU%, RSS MB or None)]
+        if self.processes is not None:
+            return self.processes
+        import psutil
+        cpuCount                    = psutil.cpu_count() or 1
+        rows                        = []
+        for p in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_info']):
+            info                    = p.info
+            cpu                     = info.get('cpu_percent')
+            rows.append((
+                info['pid'],
+                info['name'] or "",
+                -1 if cpu is None else cpu / cpuCount,
+                info['memory_info'].rss / (1024 * 1024) if info.get('memory_info') else None
+            ))
+        return rows
+
+    def page_index(self, title = "Raspberry Pi 4B WebUI", version = None):    # version : 描画した内容のライブ更新の版 (最初のポーリングから差分だけ受け取る)
+        liveVersion     = "" if version is None else f' data-version="{html.escape(version)}"'
         return { 
             "title": f"{title}", 
-            "head" : head,
-            "html": body, 
+            "head" : self.templates.load(self.assets.head(), compiled = False),
+            "html": self.templates.load("body.html", compiled = False), 
             "css": """""",
             "style" : """""",
-            "footer" : """
-<script src="/view/js/bootstrap.bundle.min.js"></script>
-<script> 
-    setTimeout(
-        function () {
-            location.href = location.origin + location.pathname; 
-        }, 30000
-    ); 
-</script>
+            "footer" : f"""
+<script src="{self.assets.url('/view/js/bootstrap.bundle.min.js')}"></script>
+<script src="{self.assets.url('/view/js/live.js')}" data-interval="{int(self.liveInterval * 1000)}"{liveVersion}></script>
 """,
             
         }
@@ -158,109 +618,31 @@ class WebCGI():
         bgColor         = "#eee",
         scales          = [0, 100]
     ):
-        maxLength       = math.pi * radius
-        
         margin          = 10
-        # 中心座標 (cx, cy)
-        cx              = radius + margin
-        cy              = radius + margin
-        
+        frame           = gauge_frame(radius, margin, tuple(scales), bgColor)
+
         # 針の長さ
         rNeedle         = radius * 1.15
         angle           = math.pi * (1 - valuePercent)
-        xNeedle         = cx + rNeedle * math.cos(angle)
-        yNeedle         = cy - rNeedle * math.sin(angle)
-
-        scaleLine       = ""
-        for s in scales:
-            p           = (s - scales[0]) / (scales[-1] - scales[0])
-            p           = max(0, min(1, p))
-
-            angle       = math.pi * (1 - p)
-
-            r1          = radius * 0.85   # 内側
-            r2          = radius * 1.00   # 外側
-
-            x1          = cx + r1 * math.cos(angle)
-            y1          = cy - r1 * math.sin(angle)
-            x2          = cx + r2 * math.cos(angle)
-            y2          = cy - r2 * math.sin(angle)
-
-            scaleLine += f"""
-            <line
-                x1="{x1}" y1="{y1}"
-                x2="{x2}" y2="{y2}"
-                stroke="#666"
-                stroke-width="0.5"
-            />
-            """
-        
-        return f"""
-<div class="position-relative d-inline-block text-start">
-    <svg class = {svgClass} viewBox="0 0 {2 * radius + (margin * 2)} {radius + (margin * 2)}">
-        <!-- 背景の半円 -->
-        <path 
-            d="
-                M
-                    {margin},{cy} 
-                A
-                    {radius},{radius} 
-                    0 0,1 
-                    {2*radius + margin}, {cy}
-            "
-            fill="none" 
-            stroke="{bgColor}" 
-            stroke-width="{margin/2}" 
-        />
-
-        <!-- 値の半円 -->
-        <path 
-            d="
-                M
-                    {margin},{cy} 
-                A
-                    {radius},{radius} 
-                    0 0,1 
-                    {2*radius + margin}, {cy}
-            "
-            fill="none" 
-            stroke = "{color}"
-            stroke-width="{margin/2}"
-            stroke-linecap="butt"
-            stroke-dasharray="{maxLength * valuePercent} {maxLength}"
-        />
-        <!-- 目盛り -->
-            {scaleLine}
-        <!-- 針 -->
-        <line
-            x1="{cx}" y1="{cy}"
-            x2="{xNeedle}" y2="{yNeedle}"
-            stroke="#000"
-            stroke-width="0.5"
-        />
-
-        <!-- 中心の丸 -->
-        <circle
-            cx="{cx}" cy="{cy}"
-            r="{radius * 0.08}"
-            fill="#000"
-        />
-    </svg>
-    <div 
-        class="
-            position-absolute
-            top-100 start-50
-            translate-middle
-            fw-bold
-            fs-4
-            text-center
-            pe-none
-        "
-    >
-        {value}
-    </div>
-</div>
-"""
+        xNeedle         = frame["cx"] + rNeedle * math.cos(angle)
+        yNeedle         = frame["cy"] - rNeedle * math.sin(angle)
+        maxLength       = frame["maxLength"]
+
+        return (
+            '<div class="position-relative d-inline-block text-start">'
+            f'<svg class="{svgClass}" viewBox="{frame["viewBox"]}">'
+            f'{frame["background"]}'
+            f'<path d="{frame["arc"]}" fill="none" stroke="{color}" stroke-width="{svg_number(margin / 2)}" '
+            f'stroke-linecap="butt" stroke-dasharray="{svg_number(maxLength * valuePercent)} {svg_number(maxLength)}"/>'
+            f'{frame["ticks"]}'
+            f'<line x1="{svg_number(frame["cx"])}" y1="{svg_number(frame["cy"])}" x2="{svg_number(xNeedle)}" y2="{svg_number(yNeedle)}" stroke="#000" stroke-width="0.5"/>'
+            f'{frame["center"]}'
+            '</svg>'
+            '<div class="position-absolute top-100 start-50 translate-middle fw-bold fs-4 text-center pe-none">'
+            f'{value}'
+            '</div>'
+            '</div>'
+        )
     
 
     def card_create(self, title = "情報", message = ""):
@@ -279,21 +661,75 @@ class WebCGI():
 </div>
 """
 
-    def html_body(self, body = "", title = "Raspberry Pi 4B WebUI", hostid = "10688"):
-        param           = self.page_index(title)
-        radius          = 20
-        xSize           = 300
-        
-        if self.zabbixToken is not None:
-            data        = GetZabbixData(token = self.zabbixToken)
-            temp        = float(data.data_request(hostid = "10084", key = "outside.temp"))
-            hum         = float(data.data_request(hostid = "10084", key = "outside.hum"))
-            cpuTemp     = float(data.data_request(hostid = hostid, key = "cpu.temp"))
-            hostName    = data.data_request(hostid = hostid, key = "system.hostname")
-        else:
-            temp        = 20
-            hum         = 50
+    def table_row(self, row, key = None):     # key を渡すと data-key を付ける (ライブ更新で行を差し替えるため)
+        parts           = ["<tr>\n" if key is None else f"""<tr data-key="{html.escape(str(key))}">\n"""]
+        for cell in row:
+            if isinstance(cell, Markup):
+                parts.append(f"""<td class="text-nowrap">{cell}</td>\n""")
+            elif isinstance(cell, tuple):
+                text, style = cell
+                parts.append(f"""<td class="text-nowrap"><span class="{html.escape(style)}">{html.escape(str(text))}</span></td>\n""")
+            else:
+                parts.append(f"""<td class="text-nowrap">{html.escape(str(cell))}</td>\n""")
+        parts.append("</tr>\n")
+        return "".join(parts)
+
+    def table_create(self, headers = [], rows = [], keyed = False):
+        # セルは文字列か (文字列, span の class) 。すべてエスケープして 1 回の join で組み立てる
+        parts           = ["""<table class= "table table-bordered table-striped">\n<thead>\n<tr>\n"""]
+        parts.extend(f"<th>{html.escape(str(h))}</th>\n" for h in headers)
+        parts.append("</tr>\n</thead>\n<tbody>\n")
+        parts.extend(self.table_row(row, row[0] if keyed else None) for row in rows)
+        parts.append("</tbody>\n</table>")
+        return "".join(parts)
+
+    def collect_metrics(self, hostid = "10688", maxAge = 0):   # → (気温, 湿度, CPU温度, ホスト名, 古い値なら経過秒数 / 新しければ None)
+        if self.zabbixToken is None:    # Zabbix 無し : 気温・湿度は元からの仮の値、CPU 温度とホスト名はこのマシンから読む
+            return 20, 50, self.local_cpu_temp(), platform.node(), None
+        path            = os.path.join(cacheDir, "metrics.json")
+        entry           = read_json(path).get(hostid)
+        if maxAge > 0:  # maxAge 秒以内に他のリクエストが取った値があればそれを使う
+            if entry and time.time() - entry["time"] < maxAge:
+                return (*entry["values"], None)
+        data            = GetZabbixData(token = self.zabbixToken, timer = self.timer)
+        try:
+            values      = data.data_request_many([
+                ("10084", "outside.temp"),
+                ("10084", "outside.hum"),
+                (hostid, "cpu.temp"),
+                (hostid, "system.hostname")
+            ])
+        except (RuntimeError, ValueError):  # Zabbix に届かないときは最後に取れた値を古いと分かる形で出す
+            if not entry:
+                raise
+            return (*entry["values"], time.time() - entry["time"])
+        metrics         = (
+            float(values[("10084", "outside.temp")]),
+            float(values[("10084", "outside.hum")]),
+            float(values[(hostid, "cpu.temp")]),
+            values[(hostid, "system.hostname")]
+        )
+        cache           = read_json(path)
+        cache[hostid]   = {"time": time.time(), "values": metrics}
+        write_json(path, cache)
+        for name, value in zip(("temp", "hum", f"cpu_temp.{hostid}"), metrics):     # 履歴 (スパークライン用) に残す
+            series      = TimeSeries(name)
+            series.append(value)
+            series.close()
+        return (*metrics, None)
+
+    def local_cpu_temp(self):   # Raspberry Pi OS の温度センサー (読めなければ 0)
+        try:
+            with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
+                return int(f.read()) / 1000
+        except (OSError, ValueError):
+            return 0.0
 
+    def gauges_create(self, temp, hum, cpuTemp, radius = 20, staleAge = None):  # → ({"temp" / "hum" / "cpu": SVG}, [警告カード])
+        cards           = []
+        if staleAge is not None:
+            age         = f"{int(staleAge // 60)} 分" if staleAge >= 60 else f"{int(staleAge)} 秒"
+            cards.append(self.card_create(title = "注意", message = f"Zabbix に接続できません。表示しているのは {age}前の値です"))
         tempValue       = max(0, min(1, (temp - (-20)) / (60 - (-20))))
         if temp < 0:
             tempColor   = "#6600FF"
@@ -303,13 +739,13 @@ class WebCGI():
             tempColor   = "#009933"
         elif temp < 35:
             tempColor   = "#FF9900"
-            body        += self.card_create(title = "注意", message = "気温が高くなっています")
+            cards.append(self.card_create(title = "注意", message = "気温が高くなっています"))
         elif temp < 45:
             tempColor   = "#FF3366"
-            body        += self.card_create(title = "警告", message = "気温が高くなっています")
+            cards.append(self.card_create(title = "警告", message = "気温が高くなっています"))
         else:
             tempColor   = "#FF0000"
-            body        += self.card_create(title = "警告", message = "気温が高くなっています")
+            cards.append(self.card_create(title = "警告", message = "気温が高くなっています"))
 
         humValue        = max(0, min(1, hum / 100))
         if hum < 20:
@@ -334,88 +770,184 @@ class WebCGI():
             cpuColor   = "#FF9900"
         elif cpuTemp < 60:
             cpuColor   = "#FF3366"
-            body        += self.card_create(title = "注意", message = "CPU温度が高くなっています")
+            cards.append(self.card_create(title = "注意", message = "CPU温度が高くなっています"))
         else:
             cpuColor   = "#FF0000"
-            body        += self.card_create(title = "警告", message = "CPU温度が高くなっています")
-        
+            cards.append(self.card_create(title = "警告", message = "CPU温度が高くなっています"))
+        if staleAge is not None:    # 古い値は灰色で出す
+            tempColor = humColor = cpuColor = "#9E9E9E"
 
-        processTable    = f"""| PID | NAME | CPU | メモリ | Port |
-| -   |  -   | -   | -      | - |
-"""
+        gauges          = {
+            "temp"      : self.gauge_create(
+                radius          = radius,
+                value           = f"{temp:.2f}℃",
+                valuePercent    = tempValue,
+                color           = tempColor,
+                scales          = [-20, 0, 20, 30, 35, 45, 60]
+            ),
+            "hum"       : self.gauge_create(
+                radius          = radius,
+                value           = f"{hum:.2f}%",
+                valuePercent    = humValue,
+                color           = humColor,
+                scales          = [0, 20, 40, 50, 60, 80, 100]
+            ),
+            "cpu"       : self.gauge_create(
+                radius          = radius,
+                value           = f"{cpuTemp:.2f}℃",
+                valuePercent    = cpuValue,
+                color           = cpuColor,
+                scales          = [0, 30, 40, 50, 60, 100]
+            )
+        }
+        return gauges, cards
 
-        # まず全接続を取得して PID → ポート一覧 の辞書を作る
-        pid_ports = {}
+    def process_view(self, params = {}):    # クエリの sort / top / filter / page を解釈する (不正な値は既定値)
+        def number(name, limit):
+            try:
+                return max(1, min(int(params[name]), limit))
+            except (KeyError, TypeError, ValueError):
+                return self.processDefaults[name]
+        sort            = params.get("sort")
+        return {
+            "sort"      : sort if sort in self.processSorts else self.processDefaults["sort"],
+            "top"       : number("top", 1000),
+            "page"      : number("page", 100000),
+            "filter"    : (params.get("filter") or "").strip()
+        }
 
-        for conn in psutil.net_connections(kind='inet'):
-            if conn.pid and conn.laddr and conn.status == psutil.CONN_LISTEN:
-                pid_ports.setdefault(conn.pid, set()).add(conn.laddr.port)
+    def process_table(self, view = None):  # → (表示する範囲の行, メモリ使用量が多いアプリ, 絞り込み後の件数)
+        view            = view or self.process_view()
+        processes       = self.process_rows()
 
-        
-        warningApps = []
-        # プロセス一覧を表示
-        for p in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_info']):
-            info        = p.info
-            pid         = info['pid']
-            nameFull    = info['name']
+        # メモリの警告は絞り込みやページに関係なく全プロセスから拾う
+        warningApps     = [(pid, nameFull, f"{mem:.2f}MB") for pid, nameFull, cpu, mem in processes if mem is not None and mem > 200]
+
+        needle          = view["filter"].lower()
+        if needle:
+            processes   = [p for p in processes if needle in p[1].lower()]
+        top             = view["top"] or max(1, len(processes))
+        view["page"]    = min(view["page"], max(1, -(-len(processes) // top)))     # 最後のページより先なら最後のページ (ページ送りもこの値を使う)
+        count           = top * view["page"]
+        if view["sort"] is None:
+            selected    = processes[count - top:count]
+        else:
+            # 必要なのは先頭から page * top 件だけなので、全体を並べ替えずにヒープで選ぶ
+            key, largest = self.processSorts[view["sort"]]
+            selected    = (heapq.nlargest if largest else heapq.nsmallest)(count, processes, key = key)[count - top:]
+
+        # PID → ポート一覧 (LISTEN のみ) は共有インデックスから引く
+        pid_ports = ListeningPorts().lookup()
+
+        processRows = []
+        for pid, nameFull, cpu, mem in selected:
             name        = nameFull 
             if len(nameFull) > 16: 
                 name    = f"{nameFull[:16]}..."
 
-            cpu         = info.get('cpu_percent', -1) / psutil.cpu_count()
             cpu_str     = f"{cpu:.2f}%" 
             if cpu < 0: 
                 cpu_str = "N/A"
 
-            mem         = float(info['memory_info'].rss)/(1024*1024) if info.get('memory_info') else '?'
-
             # ポート一覧（LISTENのみ）
             ports       = map(str,sorted(pid_ports.get(pid, set())))
             port_str    = ", ".join(ports)
 
-            if mem == '?':
+            if mem is None:
                 mem_style = ""
             elif mem > 500:
                 mem_style = "bg-danger text-black fw-bold"   # 赤
-                warningApps.append(f"| {pid} | {nameFull} | {mem:.2f}MB |")
             elif mem > 200:
                 mem_style = "bg-warning text-black fw-bold"  # オレンジ
-                warningApps.append(f"| {pid} | {nameFull} | {mem:.2f}MB |")
             else:
                 mem_style = ""
-                
 
-            processTable += f"""| {pid} | {name} | {cpu_str} | <span class="{mem_style}">{mem:.2f}MB</span> | {port_str} |
+            mem_str     = "?" if mem is None else f"{mem:.2f}MB"
+            processRows.append((pid, name, cpu_str, (mem_str, mem_style), port_str))
+        return processRows, warningApps, len(processes)
+
+    def view_url(self, view, **changes):   # 表示条件の一部を変えたリンク先
+        query           = {**view, **changes}
+        query           = {key: value for key, value in query.items() if value != self.processDefaults[key]}
+        return "?" + urllib.parse.urlencode(query) if query else "?"
+
+    def process_controls(self, view):      # 並べ替えと絞り込み (ライブ更新では書き換えない)
+        links           = "".join(
+            f"""<a class="btn btn-sm btn-outline-secondary{' active' if view['sort'] == sort else ''}" href="{html.escape(self.view_url(view, sort = sort, page = 1))}">{label}</a>"""
+            for sort, label in (("cpu", "CPU"), ("rss", "メモリ"), ("pid", "PID"), ("name", "名前"))
+        )
+        hidden          = "".join(
+            f"""<input type="hidden" name="{key}" value="{html.escape(str(view[key]))}">"""
+            for key in ("sort", "top") if view[key] != self.processDefaults[key]
+        )
+        return f"""
+<div class="d-flex flex-wrap gap-2 align-items-center">
+    <div class="btn-group">{links}</div>
+    <form method="get" class="flex-grow-1">{hidden}<input class="form-control form-control-sm" type="search" name="filter" value="{html.escape(view['filter'])}" placeholder="名前で絞り込み"></form>
+</div>
 """
-        processTable = self.md.convert(processTable)
-        processTable = processTable.replace(
-            "<table>", 
-            """<table class= "table table-bordered table-striped">"""
-        ).replace(
-            "<td>",
-            """<td class="text-nowrap">"""
+
+    def process_pager(self, view, total):  # 件数と前後のページへのリンク
+        top             = view["top"] or max(1, total)
+        start           = min(total, (view["page"] - 1) * top + 1)
+        end             = min(total, view["page"] * top)
+        previous        = f"""<a class="btn btn-sm btn-outline-secondary" href="{html.escape(self.view_url(view, page = view['page'] - 1))}">前へ</a>""" if view["page"] > 1 else ""
+        following       = f"""<a class="btn btn-sm btn-outline-secondary" href="{html.escape(self.view_url(view, page = view['page'] + 1))}">次へ</a>""" if end < total else ""
+        return f"""{previous}<span class="small text-muted">{start}-{end} / {total}</span>{following}"""
+
+    def sparkline_create(self, points, width = 120, height = 24, color = "#666", label = ""):    # [(時刻, 値)] → 折れ線の SVG
+        if len(points) < 2:
+            return ""
+        start, end      = points[0][0], points[-1][0]
+        values          = [value for when, value in points]
+        low, high       = min(values), max(values)
+        xScale          = (width - 2) / ((end - start) or 1)
+        yScale          = (height - 2) / ((high - low) or 1)
+        line            = " ".join(
+            f"{svg_number(1 + (when - start) * xScale)},{svg_number(height - 1 - (value - low) * yScale)}"
+            for when, value in points
+        )
+        return (
+            f'<svg class="sparkline" viewBox="0 0 {width} {height}" width="{width}" height="{height}">'
+            f'<polyline points="{line}" fill="none" stroke="{color}" stroke-width="1"/></svg>'
+            f'<div class="small text-muted">{html.escape(label)} {low:.1f} - {high:.1f}</div>'
         )
 
+    def sparklines(self, hostid = "10688", span = "24h"):  # ゲージの下に出す履歴 (Zabbix には問い合わせない)
+        return {
+            key         : self.sparkline_create(TimeSeries(name).read(span), label = span)
+            for key, name in (("temp", "temp"), ("hum", "hum"), ("cpu", f"cpu_temp.{hostid}"))
+        }
+
+    def series_span(self, params = {}):
+        span            = params.get("range")
+        return span if span in TimeSeries.spans else "24h"
+
+    def alert_cards(self, cards, warningApps, span = "24h"):
+        if len(warningApps) > 0:
+            trends      = [self.sparkline_create(TimeSeries(f"rss.{name}").read(span), width = 80, height = 16) for pid, name, mem in warningApps]
+            if any(trends):     # sampler.py が RSS の履歴を残していれば推移も出す
+                apps    = self.table_create(["PID", "アプリ名", "メモリ使用量", "推移"], [row + (Markup(trend),) for row, trend in zip(warningApps, trends)])
+            else:
+                apps    = self.table_create(["PID", "アプリ名", "メモリ使用量"], warningApps)
+            cards.append(self.card_create(title = "注意", message = f"""<h4 class="mb-4 border-bottom">メモリ使用量が多いアプリ</h4>{apps}"""))
+        return "".join(cards)
+
+    def html_body(self, body = "", title = "Raspberry Pi 4B WebUI", hostid = "10688", params = {}):
+        # ライブ更新と同じ部品から組み立て、その版を残しておく (最初のポーリングから差分になる)
+        snapshot        = self.live_snapshot(hostid, params)
+        LiveStates().put(snapshot["version"], snapshot["state"])
+        parts           = snapshot["parts"]
+        param           = self.page_index(title, snapshot["version"])
+        xSize           = 300
+
         processTable = f"""
-<div class = "pt-4">
-    {processTable}
+{self.process_controls(snapshot["view"])}
+<div class="d-flex gap-2 align-items-center pt-2" id="processPager">{parts["processPager"]}</div>
+<div class = "pt-2" id="processTable">
+    {self.table_create(["PID", "NAME", "CPU", "メモリ", "Port"], snapshot["rows"].values(), keyed = True)}
 </div>
 """ 
-        if len(warningApps) > 0:
-            apps = f"""
-| PID | アプリ名 | メモリ使用量 |
-| - | - | - |
-{"\n".join(warningApps)}"""
-            apps = self.md.convert(apps)
-            apps = apps.replace(
-                "<table>", 
-                """<table class= "table table-bordered table-striped">"""
-            ).replace(
-                "<td>",
-                """<td class="text-nowrap">"""
-            )
-            body        += self.card_create(title = "注意", message = f"""<h4 class="mb-4 border-bottom">メモリ使用量が多いアプリ</h4>{apps}""")
-
         param["css"]    += f"""
 .gauge {{
     width: {xSize}px;
@@ -423,81 +955,74 @@ class WebCGI():
     display: block;
 }}
 """
-        param["html"]   += f"""
-<body>
-    <div class="container pt-3">
-        <main>
-            <div class="row g-5">
-                <div class="col-md-8">
-                    <div class="d-flex flex-wrap justify-content-start gap-3 pt-3">
-                        <div class="card shadow-sm text-center" style="width: fit-content;">
-                            <div class="card-header text-start fw-bold">
-                                温度
-                            </div>
-                            <div class="card-body">
-                                {
-                                    self.gauge_create(
-                                        radius          = radius,
-                                        value           = f"{temp:.2f}℃",
-                                        valuePercent    = tempValue,
-                                        color           = tempColor,
-                                        scales          = [-20, 0, 20, 30, 35, 45, 60]
-                                    )
-                                }
-                            </div>
-                        </div>
-                        <div class="card shadow-sm text-center" style="width: fit-content;">
-                            <div class="card-header text-start fw-bold">
-                                湿度
-                            </div>
-                            <div class="card-body">
-                                {
-                                    self.gauge_create(
-                                        radius          = radius,
-                                        value           = f"{hum:.2f}%",
-                                        valuePercent    = humValue,
-                                        color           = humColor,
-                                        scales          = [0, 20, 40, 50, 60, 80, 100]
-                                    )
-                                }
-                            </div>
-                        </div>
-                        <div class="card shadow-sm text-center" style="width: fit-content;">
-                            <div class="card-header text-start fw-bold">
-                                {hostName} CPU温度
-                            </div>
-                            <div class="card-body">
-                                {
-                                    self.gauge_create(
-                                        radius          = radius,
-                                        value           = f"{cpuTemp:.2f}℃",
-                                        valuePercent    = cpuValue,
-                                        color           = cpuColor,
-                                        scales          = [0, 30, 40, 50, 60, 100]
-                                    )
-                                }
-                            </div>
-                        </div>
-                    </div>
-                    
-                    <div class="pt-4">
-                        <div class = "border-top">
-                            {body}
-                        </div>
-                    </div>
-                
-                </div>
-                <div class="col-md-4">
-                    <div class="position-sticky" style="top: 2rem;">
-                        {processTable}
-                    </div>
-                </div>
-            </div>
-        
-        </main>
-    </div>
-</body>"""
+        with self.timer.phase("template"):
+            param["html"] += self.templates.load("dashboard.html").render(
+                tempGauge       = parts["gauge-temp"],
+                humGauge        = parts["gauge-hum"],
+                cpuGauge        = parts["gauge-cpu"],
+                tempSpark       = parts["spark-temp"],
+                humSpark        = parts["spark-hum"],
+                cpuSpark        = parts["spark-cpu"],
+                hostName        = parts["hostName"],
+                body            = body,
+                alerts          = parts["alertCards"],
+                processTable    = processTable
+            )
         return param
+
+    def live_snapshot(self, hostid = "10688", params = {}):    # ライブ更新で書き換える部分 (要素の id → HTML、pid → 行のセル) とそのハッシュ
+        self.prime_processes()
+        with self.timer.phase("zabbix"):    # liveInterval 秒以内に取った値は使い回す (ETag の版がそろう)
+            temp, hum, cpuTemp, hostName, staleAge = self.collect_metrics(hostid, maxAge = self.liveInterval)
+        with self.timer.phase("gauges"):
+            gauges, cards = self.gauges_create(temp, hum, cpuTemp, staleAge = staleAge)
+        with self.timer.phase("processes"):
+            view        = self.process_view(params)
+            processRows, warningApps, total = self.process_table(view)
+
+        span            = self.series_span(params)
+        parts           = {f"gauge-{name}": svg for name, svg in gauges.items()}
+        with self.timer.phase("history"):
+            parts.update({f"spark-{name}": svg for name, svg in self.sparklines(hostid, span).items()})
+        parts["hostName"] = html.escape(str(hostName))
+        parts["alertCards"] = self.alert_cards(cards, warningApps, span)     # body (確認カードなど) は書き換えない
+        parts["processPager"] = self.process_pager(view, total)
+        rows            = {str(row[0]): row for row in processRows}    # 行の HTML は差分を返すときに変わった行だけ作る
+        state           = {
+            "parts"     : {key: digest(text) for key, text in parts.items()},
+            "rows"      : {key: digest(repr(row)) for key, row in rows.items()},
+            "order"     : digest(",".join(rows))
+        }
+        return {
+            "version"   : digest(json.dumps(state, sort_keys = True)),
+            "parts"     : parts,
+            "rows"      : rows,
+            "view"      : view,
+            "state"     : state
+        }
+
+    def live_diff(self, snapshot, previous = None):    # previous (前の版の state) から変わった部分だけにする。None なら全体
+        state           = snapshot["state"]
+        base            = previous or {"parts": {}, "rows": {}, "order": None}
+        return {
+            "version"   : snapshot["version"],
+            "interval"  : self.liveInterval,
+            "full"      : previous is None,
+            "parts"     : {key: text for key, text in snapshot["parts"].items() if base["parts"].get(key) != state["parts"][key]},
+            "rows"      : {key: self.table_row(row, row[0]) for key, row in snapshot["rows"].items() if base["rows"].get(key) != state["rows"][key]},
+            "removed"   : [key for key in base["rows"] if key not in snapshot["rows"]],
+            "order"     : list(snapshot["rows"]) if base["order"] != state["order"] else None
+        }
+
+    def live_data(self, since = None, hostid = "10688", params = {}):    # ゲージ・警告・プロセス表のうち since の版から変わった部分だけ返す
+        snapshot        = self.live_snapshot(hostid, params)
+        if since == snapshot["version"]:    # 何も変わっていなければ共有ファイルを読み書きしない
+            return self.live_diff(snapshot, snapshot["state"])
+        states          = LiveStates()
+        previous        = states.get(since) if since else None
+        states.put(snapshot["version"], snapshot["state"])
+        return self.live_diff(snapshot, previous)
+
     def cmd_exe(self, cmd = []):
         return subprocess.run(
             cmd,
@@ -535,7 +1060,16 @@ class WebCGI():
                 value = f"予約された電源動作をキャンセルしました"
             
         return self.html_body(body = f"""{self.card_create(message = value)}""")
-    def urls(self, url):
+    def urls(self, url, params = {}):
+        if url == "stream":     # SSE は常駐 (app.py) のときだけ。CGI では 204 を返してクライアントをポーリングに切り替えさせる
+            return "Status: 204 No Content\n\n"
+        if url == "metrics":    # Prometheus から読む
+            return "Content-Type: text/plain; version=0.0.4; charset=utf-8\n\n" + Histograms().render()
+        if url == "live":
+            return "Content-Type: application/json; charset=UTF-8\n\n" + json.dumps(
+                self.live_data(params.get("since"), params = params),
+                ensure_ascii = False
+            )
         if url in ["shutdown", "reboot", "stop"]:
             param = self.poweroff(url)
         elif url == "digital_signage":
@@ -555,12 +1089,126 @@ class WebCGI():
             value = "電光掲示板を再起動しました"
             param = self.html_body(body = f"""{self.card_create(message = value)}""")
         else:
-            param = self.html_body()
-        return self.template.format(lang=self.lang, **param)
+            param = self.html_body(params = params)
+        with self.timer.phase("template"):
+            return self.template.render(lang=self.lang, **param)
+
+    def data_version(self, url, params, hostid = "10688"):     # → 描画に使うデータの版。描画せずに決まらなければ None
+        if url != "index" or self.processes is None:    # 副作用のある URL と、その場で巡回するプロセス表は対象外
+            return None
+        metricsTime     = None
+        if self.zabbixToken is not None:
+            entry       = read_json(os.path.join(cacheDir, "metrics.json")).get(hostid)
+            if not entry or time.time() - entry["time"] >= self.liveInterval:
+                return None     # 描画するときに Zabbix から取り直す
+            metricsTime = entry["time"]
+        mtimes          = []
+        for path in [os.path.join(templateDir, name) for name in ("index.html", "body.html", "dashboard.html", self.assets.head())] + [self.assets.path]:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        key             = json.dumps([url, sorted(params.items()), hostid, self.lang, self.snapshot.seq, metricsTime, mtimes], default = str)
+        return hashlib.blake2b(key.encode("UTF-8"), digest_size = 12).hexdigest()
+
+    def respond(self, url, environ = os.environ, minSize = 1024, params = {}):  # → (status, headers, 本文 bytes)
+        match           = [tag.strip() for tag in environ.get("HTTP_IF_NONE_MATCH", "").split(",")]
+        version         = self.data_version(url, params)
+        if version is not None and (f'W/"{version}"' in match or "*" in match):   # データが変わっていなければ描画しない
+            headers     = [
+                ("ETag", f'W/"{version}"'),
+                ("Cache-Control", "no-cache"),
+                ("Vary", "Accept-Encoding"),
+                ("Server-Timing", self.timer.header())
+            ]
+            Histograms().record("main", url, self.timer)
+            return "304 Not Modified", headers, b""
+
+        headers, body   = split_cgi_output(self.urls(url, params))
+        if url != "metrics":
+            headers.append(("Server-Timing", self.timer.header()))
+            Histograms().record("main", url, self.timer)
+        status          = dict(headers).get("Status", "200 OK")
+        headers         = [h for h in headers if h[0] != "Status"]
+        if not status.startswith("200"):
+            return status, headers, body.encode("UTF-8")
+        data            = body.encode("UTF-8")
+        version         = self.data_version(url, params)   # 描画中に Zabbix から取り直していれば新しい版になる
+        if version is not None:
+            headers     += [
+                ("ETag", f'W/"{version}"'),
+                ("Cache-Control", "no-cache")   # 毎回再検証させ、変化が無ければ 304 で済ませる
+            ]
+        headers.append(("Vary", "Accept-Encoding"))
+
+        encoding        = accept_encoding(environ.get("HTTP_ACCEPT_ENCODING", ""), compressors())
+        if encoding is not None and len(data) >= minSize:
+            if encoding == "br":
+                import brotli
+                data    = brotli.compress(data, quality = 5)
+            else:
+                data    = gzip.compress(data, compresslevel = 6)
+            headers.append(("Content-Encoding", encoding))
+        headers.append(("Content-Length", str(len(data))))
+        return "200 OK", headers, data
+
+def accept_encoding(header = "", available = ("br", "gzip")):  # Accept-Encoding から available の中で使う圧縮方式を選ぶ (先頭優先)
+    accepted            = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        q               = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q       = float(params.strip()[2:])
+            except ValueError:
+                q       = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    wildcard            = accepted.get("*", 0.0)
+    for name in available:
+        if accepted.get(name, wildcard) > 0:
+            return name
+    return None
+
+@functools.lru_cache(maxsize = 1)
+def compressors():      # その場で圧縮できる方式 (brotli は入っていれば使う)
+    try:
+        import brotli
+        return ("br", "gzip")
+    except ImportError:
+        return ("gzip",)
+
+def precompressed(filePath, header = ""):   # build_static.py が並べて置いた .br / .gz から選ぶ → (送るファイル, Content-Encoding)
+    suffixes            = {"br": ".br", "gzip": ".gz"}
+    available           = [name for name, suffix in suffixes.items() if os.path.isfile(filePath + suffix)]
+    encoding            = accept_encoding(header, available)
+    if encoding is None:
+        return filePath, None
+    return filePath + suffixes[encoding], encoding
+
+def digest(text):       # 差分検出用の短いハッシュ
+    return hashlib.blake2b(text.encode("UTF-8"), digest_size = 8).hexdigest()
+
+def split_cgi_output(output):   # "Header: value\n\n本文" の CGI 形式を (headers, 本文) に分ける
+    head, _, body       = output.partition("\n\n")
+    headers             = []
+    for line in head.splitlines():
+        name, _, value  = line.partition(":")
+        if name.strip():
+            headers.append((name.strip(), value.strip()))
+    return headers, body
 
 
 if __name__ == "__main__": 
+    import pycgi
     form    = pycgi.FieldStorage()
-    html    = WebCGI()
+    web     = WebCGI()
+
+    params  = {key: values[0] for key, values in form.params.items()}     # 同じキーが複数あれば最初の値 (app.request_params と同じ)
 
-    print(html.urls(form.getvalue("url", default = "index")))
\ No newline at end of file
+    status, headers, data = web.respond(params.get("url", "index"), params = params)
+    if not status.startswith("200"):
+        headers = [("Status", status)] + headers
+    sys.stdout.buffer.write("".join(f"{name}: {value}\r\n" for name, value in headers).encode("UTF-8") + b"\r\n")
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.flush()
\ No newline at end of file
@@ -1,4 +1,26 @@
-from httpcgi import CGIHTTP
+import os, sys
+from httpcgi import CGIHTTP, UTF8CGIHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cgi-bin"))
+from main import precompressed
+
+class AssetHandler(UTF8CGIHandler):     # build_static.py が作った /view/dist/ は圧縮済みのファイルを長期キャッシュ付きで返す
+    def send_head(self):
+        path                = self.path.split("?", 1)[0]
+        filePath            = self.translate_path(path)
+        if not path.startswith("/view/dist/") or not os.path.isfile(filePath):
+            return super().send_head()
+        sendPath, encoding  = precompressed(filePath, self.headers.get("Accept-Encoding", ""))
+        f                   = open(sendPath, "rb")
+        self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(filePath))
+        self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+        self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        self.send_header("Vary", "Accept-Encoding")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        return f
 
 if __name__ == "__main__":
-    CGIHTTP("0.0.0.0", 8000).serve_forever()
\ No newline at end of file
+    CGIHTTP("0.0.0.0", 8000, AssetHandler).serve_forever()
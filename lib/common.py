@@ -0,0 +1,577 @@
+# main.py / info.py / app.py で共有する設定・キャッシュ・上流への接続 (cgi-bin の下は全部スクリプトとして実行されるので、その外に置く)
+import os, json, time, tempfile, contextlib
+# requests / fcntl は使う処理の中で import する
+
+cacheDir                    = os.environ.get(
+    "CGITEST_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "cgitest")
+)
+tokenDir                    = os.environ.get(
+    "CGITEST_TOKEN_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "TOKEN")
+)
+zabbixURL                   = os.environ.get(
+    "CGITEST_ZABBIX_URL",
+    "http://raspi5.lan:8080/api_jsonrpc.php"
+)
+
+httpSessions                = {}    # (name, 設定) → Session
+
+def http_session(   # プロセス内で使い回す keep-alive 接続プール (同じ名前でも設定が違えば別のプール)
+    name                    = "default",
+    poolSize                = 4,
+    retries                 = 2,            # 冪等なメソッド (GET など) の 502/503/504 のみ再試行
+    backoff                 = 0.2,
+    keepAlive               = True
+):
+    key                     = (name, poolSize, retries, backoff, keepAlive)
+    session                 = httpSessions.get(key)
+    if session is not None:
+        return session
+
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    adapter                 = HTTPAdapter(
+        pool_connections    = poolSize,
+        pool_maxsize        = poolSize,
+        max_retries         = Retry(
+            total           = retries,
+            connect         = 0,            # 接続・読み取りの timeout は再試行すると待ち時間が倍になる (締め切りを超える)
+            read            = 0,
+            status          = retries,
+            backoff_factor  = backoff,
+            status_forcelist = (502, 503, 504),
+            allowed_methods = Retry.DEFAULT_ALLOWED_METHODS,   # POST (Zabbix API) は再試行しない
+            raise_on_status = False
+        )
+    )
+    session                 = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not keepAlive:
+        session.headers["Connection"] = "close"
+    httpSessions[key]       = session
+    return session
+
+def read_json(path):     # 共有ファイルを読む (無い・壊れている場合は空の dict)
+    try:
+        with open(path, "r", encoding="UTF-8") as f:
+            data            = json.load(f)
+    except (OSError, ValueError):
+        data                = {}
+    return data if isinstance(data, dict) else {}
+
+def write_json(path, data):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        fd, tmp             = tempfile.mkstemp(dir = os.path.dirname(path))
+        with os.fdopen(fd, "w", encoding="UTF-8") as f:
+            f.write(json.dumps(data, ensure_ascii = False))   # json.dump は Python 実装の逐次エンコードで遅い
+        os.replace(tmp, path)               # 書き込み途中のファイルを他プロセスに見せない
+    except OSError:
+        pass                                # キャッシュが使えなくても本体の処理は続ける
+
+@contextlib.contextmanager
+def file_lock(path):    # path を読んで書き戻す間、他のプロセスの読み書きを待たせる (path + ".lock" を flock する)
+    try:
+        import fcntl
+    except ImportError:
+        fcntl               = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        lock                = open(path + ".lock", "a")
+    except OSError:
+        yield                               # ロックが取れなくても本体の処理は続ける
+        return
+    with lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+class Deadline:     # リクエスト全体の締め切り。上流への timeout は残り時間で切る
+    def __init__(self, seconds):
+        self.end            = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.end - time.monotonic())
+
+    def timeout(self, limit):   # → min(limit, 残り時間)。使い切っていれば問い合わせずに失敗する
+        remaining           = self.remaining()
+        if remaining <= 0:
+            raise TimeoutError("request deadline exceeded")
+        return min(limit, remaining)
+
+class ItemCache:    # (hostid, key, mode) → (itemid, value_type) をプロセス間で共有
+    def __init__(
+        self,
+        path                = os.path.join(cacheDir, "zabbix_items.json"),
+        ttl                 = 3600
+    ):
+        self.path           = path
+        self.ttl            = ttl
+        self.items          = None
+
+    def cache_key(self, hostid, key, mode):
+        return f"{hostid}|{mode}|{key}"
+
+    def read(self):
+        return read_json(self.path)
+
+    def write(self, items):
+        write_json(self.path, items)
+        self.items          = items
+
+    def get(self, hostid, key, mode = "filter"):
+        if self.items is None:
+            self.items      = self.read()
+        entry               = self.items.get(self.cache_key(hostid, key, mode))
+        if entry is None or time.time() - entry.get("time", 0) > self.ttl:
+            return None
+        return entry["itemid"], entry["value_type"]
+
+    def set(self, hostid, key, mode, itemid, value_type):
+        self.set_many([(hostid, key, mode, itemid, value_type)])
+
+    def set_many(self, entries):
+        items               = self.read()   # 他プロセスの更新を取り込んでから書く
+        for hostid, key, mode, itemid, value_type in entries:
+            items[self.cache_key(hostid, key, mode)] = {
+                "itemid"    : itemid,
+                "value_type": value_type,
+                "time"      : time.time()
+            }
+        self.write(items)
+
+    def invalidate(self, hostid, key, mode = "filter"):
+        items               = self.read()
+        if items.pop(self.cache_key(hostid, key, mode), None) is not None:
+            self.write(items)
+        else:
+            self.items      = items
+
+class CircuitOpenError(RuntimeError):   # 遮断中なので問い合わせずに失敗した
+    pass
+
+class ZabbixAPIError(RuntimeError):     # 通信は成功して API がエラーを返した
+    def __init__(self, error):
+        self.code           = error.get("code")
+        self.data           = error.get("data") or ""
+        super().__init__(
+            f"""Zabbix API error {self.code}: 
+{error.get('message')} ({error.get('data')})"""
+        )
+
+    def missing_object(self):   # 指定した itemid が削除されている (Zabbix は権限不足と同じ文言で返す)
+        return "does not exist" in self.data or "No permissions to referred object" in self.data
+
+class CircuitBreaker:   # 上流ごとの遮断器。失敗が threshold 回続いたら cooldown 秒は問い合わせずに失敗させる (状態はプロセス間で共有)
+    def __init__(
+        self,
+        name,
+        path                = os.path.join(cacheDir, "breakers.json"),
+        threshold           = 3,
+        cooldown            = 30
+    ):
+        self.name           = name
+        self.path           = path
+        self.threshold      = threshold
+        self.cooldown       = cooldown
+
+    def allow(self):        # 遮断中でも cooldown が過ぎていれば 1 回だけ試す (試している間は他のプロセスは待たずに失敗)
+        entry               = read_json(self.path).get(self.name)
+        if not entry or not entry.get("openedAt"):
+            return True     # 閉じている間はロックを取らない
+        if time.time() - entry["openedAt"] < self.cooldown:
+            return False
+        with file_lock(self.path):  # 試す 1 回を取れるのは 1 プロセスだけ
+            states          = read_json(self.path)
+            entry           = states.get(self.name)
+            if not entry or not entry.get("openedAt"):
+                return True
+            if time.time() - entry["openedAt"] < self.cooldown:
+                return False
+            entry["openedAt"] = time.time()
+            write_json(self.path, states)
+        return True
+
+    def success(self):
+        if self.name not in read_json(self.path):
+            return          # 閉じたままなら書かない
+        with file_lock(self.path):
+            states          = read_json(self.path)
+            if states.pop(self.name, None) is not None:
+                write_json(self.path, states)
+
+    def failure(self):
+        with file_lock(self.path):
+            states          = read_json(self.path)
+            entry           = states.setdefault(self.name, {"failures": 0, "openedAt": 0})
+            entry["failures"] += 1
+            if entry["failures"] >= self.threshold:
+                entry["openedAt"] = time.time()
+            write_json(self.path, states)
+
+class PhaseTimer:   # 1 リクエスト内の区間ごとの時間 (Server-Timing ヘッダーとヒストグラムに出す)
+    def __init__(self):
+        self.start          = time.perf_counter()
+        self.phases         = []    # (区間名, 秒)
+        self.upstreams      = []    # (上流名, 秒)
+        self.errors         = []    # 失敗した上流名
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start               = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    @contextlib.contextmanager
+    def upstream(self, name):   # 上流への 1 回の問い合わせ。例外が出たら失敗として数える
+        start               = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors.append(name)
+            raise
+        finally:
+            self.upstreams.append((name, time.perf_counter() - start))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def header(self):           # → Server-Timing の値 (同じ区間は合計する)
+        totals              = {}
+        for name, seconds in self.phases:
+            totals[name]    = totals.get(name, 0.0) + seconds
+        totals["total"]     = self.elapsed()
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+class Histograms:   # Prometheus 形式のヒストグラムとカウンター。CGI はリクエストごとに別プロセスなので、プロセスごとのファイルに積み上げて render() で合算する
+    buckets                 = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    urls                    = ("index", "live", "stream", "shutdown", "reboot", "stop", "digital_signage", "get_data", "refresh", "hub")
+    foldAt                  = 32        # ファイルがこの数を超えたら record() でも終了したプロセスの分を畳む (scrape されていなくても増え続けない)
+
+    def __init__(self, directory = os.path.join(cacheDir, "histograms")):
+        self.directory      = directory     # <pid>.json : 各プロセスの分 merged.json : 終了したプロセスの分を畳んだもの
+
+    @contextlib.contextmanager
+    def opened(self, path, wait = True):    # ファイルを開いてロックする (競合するのは同じプロセスのスレッドと畳む処理だけ)。wait = False で取れなければ None
+        try:
+            import fcntl
+        except ImportError:
+            fcntl           = None
+        os.makedirs(self.directory, exist_ok = True)
+        while True:
+            f               = open(path, "a+", encoding="UTF-8")
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    f.close()
+                    yield None
+                    return
+            if os.fstat(f.fileno()).st_nlink:
+                break
+            f.close()       # ロックを待つ間に畳んで消されたので開き直す
+        try:
+            yield f
+        finally:
+            f.close()
+
+    def load(self, f):
+        f.seek(0)
+        try:
+            metrics         = json.loads(f.read() or "{}")
+        except ValueError:
+            metrics         = {}            # 書き込み途中で落ちたプロセスの分は捨てる
+        metrics             = metrics if isinstance(metrics, dict) else {}
+        metrics.setdefault("histograms", {})
+        metrics.setdefault("counters", {})
+        return metrics
+
+    def save(self, f, metrics):
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(metrics))
+
+    def merge(self, total, metrics):
+        for name, entry in metrics["histograms"].items():
+            into            = total["histograms"].setdefault(name, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            into["buckets"] = [a + b for a, b in zip(into["buckets"], entry["buckets"])]
+            into["sum"]     += entry["sum"]
+            into["count"]   += entry["count"]
+        for name, count in metrics["counters"].items():
+            total["counters"][name] = total["counters"].get(name, 0) + count
+
+    def alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass            # 権限が無いだけで動いている
+        return True
+
+    def observe(self, metrics, name, value):
+        entry               = metrics["histograms"].setdefault(name, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry["buckets"][i] += 1
+        entry["sum"]        += value
+        entry["count"]      += 1
+
+    def record(self, script, url, timer):   # 1 リクエスト分をまとめて自分のプロセスのファイルに 1 回で書く
+        url                 = url if url in self.urls else "other"     # ラベルの種類を増やさない
+        with self.opened(os.path.join(self.directory, f"{os.getpid()}.json")) as f:
+            metrics         = self.load(f)
+            self.observe(metrics, f'cgitest_request_seconds{{script="{script}",url="{url}"}}', timer.elapsed())
+            for name, seconds in timer.phases:
+                self.observe(metrics, f'cgitest_phase_seconds{{script="{script}",phase="{name}"}}', seconds)
+            for name, seconds in timer.upstreams:
+                self.observe(metrics, f'cgitest_upstream_seconds{{upstream="{name}"}}', seconds)
+            for name in timer.errors:
+                key         = f'cgitest_upstream_errors_total{{upstream="{name}"}}'
+                metrics["counters"][key] = metrics["counters"].get(key, 0) + 1
+            self.save(f, metrics)
+        if len(os.listdir(self.directory)) > self.foldAt:   # CGI は 1 リクエストごとに別の pid なので、ここで畳まないとファイルが溜まる
+            with self.opened(os.path.join(self.directory, "merged.json"), wait = False) as merged:
+                if merged is not None:      # 他のプロセスが畳んでいる最中なら任せる
+                    self.fold(merged)
+
+    def fold(self, merged):     # 終了したプロセスのファイルを merged.json に足して消す → (merged の内容, 動いているプロセスの分)
+        total               = self.load(merged)
+        running             = []
+        folded              = False
+        for name in os.listdir(self.directory):
+            pid, ext        = os.path.splitext(name)
+            if ext != ".json" or not pid.isdigit():
+                continue
+            path            = os.path.join(self.directory, name)
+            with self.opened(path) as f:
+                metrics     = self.load(f)
+                if self.alive(int(pid)):
+                    running.append(metrics)
+                    continue
+                self.merge(total, metrics)
+                os.unlink(path)
+                folded      = True
+        if folded:
+            self.save(merged, total)
+        return total, running
+
+    def collect(self):      # → 全プロセスの合計
+        with self.opened(os.path.join(self.directory, "merged.json")) as merged:
+            total, running  = self.fold(merged)
+        for metrics in running:
+            self.merge(total, metrics)
+        return total
+
+    def render(self):       # → text/plain; version=0.0.4
+        metrics             = self.collect()
+        lines, typed        = [], set()
+        for name, entry in sorted(metrics.get("histograms", {}).items()):
+            family, labels  = name[:-1].split("{", 1)
+            if family not in typed:
+                lines.append(f"# TYPE {family} histogram")
+                typed.add(family)
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                lines.append(f'{family}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{family}_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+            lines.append(f"{family}_sum{{{labels}}} {entry['sum']:.6f}")
+            lines.append(f"{family}_count{{{labels}}} {entry['count']}")
+        for name, count in sorted(metrics.get("counters", {}).items()):
+            family          = name.split("{", 1)[0]
+            if family not in typed:
+                lines.append(f"# TYPE {family} counter")
+                typed.add(family)
+            lines.append(f"{name} {count}")
+        return "\n".join(lines) + "\n"
+
+class GetZabbixData:
+    def __init__(
+        self,
+        url                 = zabbixURL,
+        token               = "XXXXXXXXXXXXXXXXXX",
+        itemCache           = None,
+        session             = None,
+        breaker             = None,
+        timeout             = 5,
+        timer               = None
+    ):
+        self.zabbixURL      = url
+        self.token          = token
+        self.itemCache      = ItemCache() if itemCache is None else itemCache
+        self.session        = http_session("zabbix") if session is None else session
+        self.breaker        = CircuitBreaker(url) if breaker is None else breaker
+        self.timeout        = timeout
+        self.deadline       = None    # Deadline を入れると timeout を残り時間で切る
+        self.timer          = PhaseTimer() if timer is None else timer
+
+    def zabbix_request(
+        self,
+        method,
+        params
+    ):
+        payload             = {
+            "jsonrpc"       : "2.0",
+            "method"        : method,
+            "params"        : params,
+            "auth"          : self.token,
+            "id"            : 1
+        }
+        if not self.breaker.allow():  # 落ちている間は timeout まで待たずにすぐ失敗する
+            raise CircuitOpenError(f"Zabbix API circuit open: {self.zabbixURL}")
+        timeout             = self.timeout if self.deadline is None else self.deadline.timeout(self.timeout)
+        try:
+            with self.timer.upstream("zabbix"):
+                r           = self.session.post(self.zabbixURL, json = payload, timeout = timeout)
+                r.raise_for_status()
+        except Exception as e: 
+            import requests
+            if not (isinstance(e, requests.Timeout) and timeout < self.timeout):   # 締め切りで短くした timeout は故障に数えない
+                self.breaker.failure()
+            raise RuntimeError(f"Zabbix API request failed: {e}")
+        self.breaker.success()
+        
+        res                 = r.json()
+        if "error" in res:
+            raise ZabbixAPIError(res["error"])
+
+        return res
+    
+    def get_item_info(
+        self,
+        hostid              = "10084",
+        key                 = "outside.temp",
+        mode                = "filter",         # filter : 完全一致 search : 部分一致
+        refresh             = False             # True : キャッシュを使わず item.get する
+    ):
+        if mode not in ("filter", "search"):
+            raise ValueError("mode must be 'filter' or 'search'")
+        if not refresh:
+            cached          = self.itemCache.get(hostid, key, mode)
+            if cached is not None:
+                return cached
+
+        item                = self.zabbix_request(
+            "item.get", 
+            {
+                "hostids"   : hostid,
+                mode        : {
+                    "key_"  : key
+                },
+                "output"    : [
+                    "itemid", 
+                    "value_type"
+                ]
+            }
+        ).get("result", [])
+
+        if not item: 
+            self.itemCache.invalidate(hostid, key, mode)
+            raise ValueError(f"Item '{key}' not found on host {hostid}")
+        
+        if len(item) > 1:
+            print(f"Warning: multiple items matched '{key}', using first")
+
+        self.itemCache.set(hostid, key, mode, item[0]["itemid"], item[0]["value_type"])
+        return item[0]["itemid"], item[0]["value_type"]
+
+    def history_request(self, itemid, value_type):
+        return self.zabbix_request(
+            "history.get", 
+            {
+                "history"   : value_type,
+                "itemids"   : itemid,
+                "sortfield" : "clock",
+                "sortorder" : "DESC",
+                "limit"     : 1
+            }
+        ).get("result", [])
+    
+    def data_request(   # 最新値を取得
+        self,
+        hostid              = "10084",
+        key                 = "outside.temp"
+    ):
+        cached              = self.itemCache.get(hostid, key, "filter")
+        itemid, value_type  = self.get_item_info(hostid, key)
+
+        try:
+            value           = self.history_request(itemid, value_type)
+        except ZabbixAPIError as e:
+            # 通信の失敗 (timeout / 5xx / 遮断中) はそのまま上げる。引き直すのは itemid が無いと言われたときだけ
+            if cached is None or not e.missing_object():
+                raise
+            value           = []
+
+        if not value and cached is not None:
+            # キャッシュした itemid が削除・変更されている可能性があるので引き直す
+            self.itemCache.invalidate(hostid, key, "filter")
+            itemid, value_type = self.get_item_info(hostid, key, refresh = True)
+            value           = self.history_request(itemid, value_type)
+
+        if not value:
+            raise ValueError(f"No history found for itemid {itemid}")
+
+        return value[0]["value"]
+
+    def data_request_many(  # 複数の最新値をまとめて取得 → {(hostid, key) : value}
+        self,
+        items               = (("10084", "outside.temp"),)
+    ):
+        pairs               = [(str(hostid), key) for hostid, key in items]     # Zabbix は hostid を文字列で返す
+        resolved            = {}
+        for pair in pairs:
+            cached          = self.itemCache.get(*pair, "filter")
+            if cached is not None:
+                resolved[pair] = cached
+        missing             = [pair for pair in pairs if pair not in resolved]
+
+        # 最新値は item.get の lastvalue / lastclock で 1 回に取る (history.get と違って更新の遅いアイテムも取りこぼさない)
+        output              = ["itemid", "value_type", "hostid", "key_", "lastvalue", "lastclock"]
+        if missing:
+            # 未解決のアイテムがあれば hostid と key_ で全部まとめて引き、itemid も覚える
+            params          = {
+                "hostids"   : sorted({hostid for hostid, key in pairs}),
+                "filter"    : {
+                    "key_"  : sorted({key for hostid, key in pairs})
+                },
+                "output"    : output
+            }
+        else:
+            params          = {
+                "itemids"   : sorted({itemid for itemid, value_type in resolved.values()}),
+                "output"    : output
+            }
+        found               = self.zabbix_request("item.get", params).get("result", [])
+
+        latest              = {}
+        entries             = []
+        for item in found:
+            pair            = (item["hostid"], item["key_"])
+            if pair in missing and pair not in resolved:
+                resolved[pair] = (item["itemid"], item["value_type"])
+                entries.append((*pair, "filter", item["itemid"], item["value_type"]))
+            if int(item.get("lastclock") or 0) > 0:     # 0 は値がまだ一度も届いていない
+                latest[item["itemid"]] = item["lastvalue"]
+        if entries:
+            self.itemCache.set_many(entries)
+
+        for hostid, key in missing:
+            if (hostid, key) not in resolved:
+                raise ValueError(f"Item '{key}' not found on host {hostid}")
+
+        values              = {}            # キーは呼び出し側が渡した (hostid, key) のまま
+        for item, pair in zip(items, pairs):
+            itemid          = resolved[pair][0]
+            if itemid in latest:
+                values[tuple(item)] = latest[itemid]
+            else:
+                # 値が無いもの (キャッシュした itemid が消えた場合も) だけ個別に取得する
+                values[tuple(item)] = self.data_request(*pair)
+
+        return values
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+
+# プロセス一覧を一定間隔で巡回し、WebCGI が読む共有スナップショットを更新し続ける常駐プロセス
+# python sampler.py [--interval 2] [--window 5]
+# CGI と同じ CGITEST_CACHE_DIR を指定して、Web サーバのユーザーで動かす
+
+import os, sys, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cgi-bin"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib"))
+
+from main import ProcessSampler
+
+if __name__ == "__main__":
+    parser                  = argparse.ArgumentParser(description = "プロセス一覧のサンプラー")
+    parser.add_argument("--interval", type = float, default = 2.0, help = "巡回間隔 (秒)")
+    parser.add_argument("--window", type = int, default = 5, help = "移動平均に使うサンプル数")
+    args                    = parser.parse_args()
+
+    try:
+        ProcessSampler(interval = args.interval, window = args.window).run()
+    except KeyboardInterrupt:
+        pass
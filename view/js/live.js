@@ -0,0 +1,107 @@
+// ゲージ・警告・プロセス表を ?url=stream (SSE) か ?url=live の差分で書き換える (ページ全体の再読み込みはしない)
+(function() {
+    var script      = document.currentScript;
+    var interval    = Number(script.getAttribute("data-interval")) || 5000;
+    var version     = script.getAttribute("data-version");    // 描画したページの版 (最初のポーリングから差分だけ受け取る)
+
+    function toRow(text) {
+        var template        = document.createElement("template");
+        template.innerHTML  = text.trim();
+        return template.content.firstElementChild;
+    }
+
+    function apply(data) {
+        Object.keys(data.parts).forEach(function(id) {
+            var element     = document.getElementById(id);
+            if (element) {
+                element.innerHTML = data.parts[id];
+            }
+        });
+
+        var tbody   = document.querySelector("#processTable tbody");
+        if (tbody) {
+            var rows    = {};
+            Array.prototype.forEach.call(tbody.querySelectorAll("tr[data-key]"), function(tr) {
+                rows[tr.getAttribute("data-key")] = tr;
+            });
+            if (data.full) {
+                Object.keys(rows).forEach(function(key) {
+                    if (!(key in data.rows)) {
+                        tbody.removeChild(rows[key]);
+                        delete rows[key];
+                    }
+                });
+            }
+            data.removed.forEach(function(key) {
+                if (rows[key]) {
+                    tbody.removeChild(rows[key]);
+                    delete rows[key];
+                }
+            });
+            Object.keys(data.rows).forEach(function(key) {
+                var tr      = toRow(data.rows[key]);
+                if (rows[key]) {
+                    tbody.replaceChild(tr, rows[key]);
+                } else {
+                    tbody.appendChild(tr);
+                }
+                rows[key]   = tr;
+            });
+            if (data.order) {
+                data.order.forEach(function(key) {
+                    if (rows[key]) {
+                        tbody.appendChild(rows[key]);   // 付け直すと末尾へ移動する
+                    }
+                });
+            }
+        }
+        version     = data.version;
+        interval    = (data.interval || interval / 1000) * 1000;
+    }
+
+    function poll() {       // 並べ替えや絞り込みの条件 (location.search) はそのまま付けて送る
+        var query   = new URLSearchParams(location.search);
+        query.set("url", "live");
+        query.delete("since");
+        if (version) {
+            query.set("since", version);
+        }
+        fetch(location.pathname + "?" + query.toString(), {cache: "no-cache"})
+            .then(function(response) {
+                if (!response.ok) {
+                    throw new Error(response.status);
+                }
+                return response.json();
+            })
+            .then(apply)
+            .catch(function() {
+                version     = null;     // 次は全体を取り直す
+            })
+            .then(function() {
+                setTimeout(poll, interval);
+            });
+    }
+
+    function stream() {     // app.py なら SSE で受け取る。CGI は 204 を返すのでポーリングに切り替える
+        var source  = new EventSource(location.pathname + "?url=stream");
+        source.onmessage = function(event) {
+            apply(JSON.parse(event.data));
+        };
+        source.onerror = function() {
+            if (source.readyState === EventSource.CLOSED) {
+                source.close();
+                version     = null;
+                setTimeout(poll, interval);
+            }
+        };
+    }
+
+    var custom      = ["sort", "top", "filter", "page", "range"].some(function(key) {
+        return new URLSearchParams(location.search).has(key);
+    });
+    if (window.EventSource && !custom) {    // SSE で配るのは既定の表示だけ
+        stream();
+    } else {
+        setTimeout(poll, interval);
+    }
+})();